@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+
+import argparse
+import itertools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import unittest
+from datetime import datetime, timedelta
+from PIL import Image, ImageDraw
+
+import fetch
+import fixtures
+import quantize
+import render_raster
+import render_svg
+import wx_data
+from colors import colors
+from scheduler import location_key
+
+RESOLUTIONS = [(600, 448), (800, 480), (1600, 1200)]
+RENDER_METHODS = ['render_chrome', 'render_grid', 'render_precipitation', 'render_temperature',
+                  'render_sky_icons', 'render_wind', 'render_header']
+
+def measure(function, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+def svg2png():
+    try:
+        from cairosvg import svg2png
+    except (ImportError, OSError):
+        return None
+    return svg2png
+
+def data_stages(scenario, endpoint):
+    document = fixtures.forecast_bytes(scenario, endpoint)
+    headers = fixtures.headers()
+    parsed = json.loads(document)
+    forecast = wx_data.wx(parsed, headers, render_svg.renderer.fields)
+    now = fixtures.START + timedelta(minutes=30)
+    return [
+        ('json_decode', lambda: json.loads(document)),
+        ('wx', lambda: wx_data.wx(parsed, headers, render_svg.renderer.fields)),
+        ('wx_stream', lambda: wx_data.wx.from_stream([document], headers, render_svg.renderer.fields)),
+        ('predictions', lambda: forecast.predictions(now))
+    ], forecast, now
+
+def render_stages(renderer, forecast, now):
+    predictions = renderer.window(forecast, now)
+    renderer._get_limits(predictions)
+    renderer.get_layout(now)
+    if isinstance(renderer, render_raster.renderer):
+        renderer.image = Image.new('RGBA', (renderer.width, renderer.height), (0, 0, 0, 0))
+        renderer.draw = ImageDraw.Draw(renderer.image, 'RGBA')
+    stages = [('window', lambda: renderer.window(forecast, now)),
+              ('_get_limits', lambda: renderer._get_limits(predictions)),
+              ('layout', lambda: renderer.make_layout(now))]
+    for name in RENDER_METHODS:
+        stages.append((name, getattr(renderer, name)))
+    stages.append(('render_hours', lambda: renderer.render_hours(now)))
+    return stages
+
+def image_stages(image, size):
+    return [
+        ('resize', lambda: image.resize(size)),
+        ('quantize_nearest', lambda: quantize.quantize(image, 'nearest')),
+        ('quantize_diffusion', lambda: quantize.quantize(image, 'diffusion'))
+    ]
+
+def run_benchmarks(scenarios, endpoints, resolutions, backends, repeat, horizons = (12,)):
+    results = {}
+    def record(prefix, stages):
+        for name, function in stages:
+            results['{}/{}'.format(prefix, name)] = measure(function, repeat)
+    convert = svg2png()
+    for scenario in scenarios:
+        for endpoint in endpoints:
+            stages, forecast, now = data_stages(scenario, endpoint)
+            record('{}/{}'.format(scenario, endpoint), stages)
+        for (width, height), backend, hours in itertools.product(resolutions, backends, horizons):
+            prefix = '{}/{}/{}x{}'.format(scenario, backend, width, height)
+            if hours != render_svg.renderer.hours:
+                prefix += '/{}h'.format(hours)
+            if backend == 'svg':
+                renderer = render_svg.renderer((width, height), 'Bench', colors({}), hours=hours)
+            else:
+                renderer = render_raster.renderer((width, height), 'Bench', colors({}), hours=hours)
+            record(prefix, render_stages(renderer, forecast, now))
+            if backend == 'svg':
+                svg = renderer.render_svg(forecast, now)
+                record(prefix, [('render_svg', lambda: (renderer.layer_cache.clear(), renderer.render_svg(forecast, now)))])
+                if convert is None:
+                    continue
+                record(prefix, [('svg2png', lambda: convert(svg.encode(), unsafe=True, output_width=600, output_height=448))])
+                image = renderer.render_image(forecast, now).convert('RGB')
+            else:
+                record(prefix, [('render_image', lambda: (renderer.layer_cache.clear(), renderer.render_image(forecast, now)))])
+                image = renderer.render_image(forecast, now)
+            record(prefix, image_stages(image, (width, height)))
+    return results
+
+STARTUP_PROBE = '''
+import asyncio, os, sys
+import fetch, metrics, scheduler
+def offline(*args):
+    raise OSError('offline')
+fetch.fetch_forecast = offline
+async def first_frame():
+    task = asyncio.ensure_future(scheduler.scheduler(sys.argv[1]).run())
+    while not any(name == 'display_refresh' for name, _ in metrics.default.counters):
+        if task.done():
+            task.result()
+            os._exit(1)
+        await asyncio.sleep(0.005)
+    os._exit(0)
+asyncio.run(first_frame())
+'''
+
+def timed_process(args, cwd):
+    start = time.perf_counter()
+    process = subprocess.Popen(args, cwd=cwd)
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise RuntimeError("{} failed with status {}".format(' '.join(args), process.returncode))
+    return elapsed, usage.ru_maxrss * 1024
+
+def startup_stages(repeat):
+    here = os.path.dirname(os.path.abspath(__file__))
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        now = datetime.now(fixtures.START.tzinfo).replace(minute=0, second=0, microsecond=0)
+        frame_state = os.path.join(directory, 'displays', 'bench', 'last_frame')
+        lat, long = 59.91, 10.75
+        url = fetch.forecast_url(*location_key(lat, long), fetch.choose_endpoint('auto', render_svg.renderer.fields))
+        config = os.path.join(directory, 'config.json')
+        with open(config, 'w') as f:
+            json.dump({'user_agent': 'bench', 'lat': lat, 'long': long, 'placename': 'Bench',
+                       'cache_dir': directory, 'prerender_hours': 0,
+                       'displays': [{'name': 'bench', 'location': 'default', 'type': 'null'}]}, f)
+        cache = fetch.forecast_cache(os.path.join(directory, '{},{}'.format(*location_key(lat, long))))
+        cache.store(url, [fixtures.forecast_bytes('calm', start=now)], fixtures.headers(now + timedelta(hours=1)))
+        for name, args in [('import', [sys.executable, '-c', 'import wx']),
+                           ('first_frame', [sys.executable, '-c', STARTUP_PROBE, config])]:
+            runs = []
+            for _ in range(repeat):
+                if os.path.exists(frame_state):
+                    os.remove(frame_state)
+                runs.append(timed_process(args, here))
+            results['startup/{}'.format(name)] = (min(r[0] for r in runs), max(r[1] for r in runs))
+    return results
+
+def compare(results, baseline, threshold, min_seconds = 0.0005, min_bytes = 65536):
+    regressions = []
+    for name, (seconds, peak) in results.items():
+        if name not in baseline:
+            continue
+        base_seconds, base_peak = baseline[name]
+        if seconds > base_seconds*(1 + threshold) and seconds - base_seconds > min_seconds:
+            regressions.append((name, 'time', base_seconds, seconds))
+        if peak > base_peak*(1 + threshold) and peak - base_peak > min_bytes:
+            regressions.append((name, 'memory', base_peak, peak))
+    return regressions
+
+def report(results, baseline, out = sys.stdout):
+    out.write('{:<60} {:>10} {:>10} {:>10}\n'.format('stage', 'ms', 'peak KiB', 'base ms'))
+    for name, (seconds, peak) in results.items():
+        base = '{:.3f}'.format(baseline[name][0]*1000) if name in baseline else '-'
+        out.write('{:<60} {:>10.3f} {:>10.1f} {:>10}\n'.format(name, seconds*1000, peak/1024, base))
+
+def parse_resolution(text):
+    width, height = text.split('x')
+    return (int(width), int(height))
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--baseline", type=str, default='bench_baseline.json', help="baseline file (defaults to ./bench_baseline.json)")
+    parser.add_argument("--save", action='store_true', help="store the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown relative to the baseline (defaults to 0.25)")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per stage, the fastest is reported (defaults to 5)")
+    parser.add_argument("--scenario", action='append', choices=list(fixtures.SCENARIOS), help="fixture to run (defaults to all)")
+    parser.add_argument("--endpoint", action='append', choices=['complete', 'compact'], help="response type to parse (defaults to both)")
+    parser.add_argument("--resolution", action='append', type=parse_resolution, help="WIDTHxHEIGHT to render (defaults to {})".format(
+        ', '.join('{}x{}'.format(*r) for r in RESOLUTIONS)))
+    parser.add_argument("--backend", action='append', choices=['raster', 'svg'], help="renderer to run (defaults to both)")
+    parser.add_argument("--hours", action='append', type=int, help="forecast horizon to render (defaults to 12)")
+    parser.add_argument("--startup", action='store_true', help="only time the start up to the first frame")
+    args = parser.parse_args()
+
+    if args.startup:
+        results = startup_stages(args.repeat)
+    else:
+        results = run_benchmarks(args.scenario or list(fixtures.SCENARIOS),
+                                 args.endpoint or ['complete', 'compact'],
+                                 args.resolution or RESOLUTIONS,
+                                 args.backend or ['raster', 'svg'],
+                                 args.repeat,
+                                 args.hours or [render_svg.renderer.hours])
+    try:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    except OSError:
+        baseline = {}
+    report(results, baseline)
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump({**baseline, **results}, f, indent=1, sort_keys=True)
+        return 0
+    regressions = compare(results, baseline, args.threshold)
+    for name, kind, base, value in regressions:
+        sys.stdout.write('REGRESSION {} {}: {:.6g} -> {:.6g}\n'.format(name, kind, base, value))
+    return 1 if regressions else 0
+
+class Test_bench(unittest.TestCase):
+    def test_compare(self):
+        baseline = {'a': [0.010, 100000], 'b': [0.010, 100000], 'c': [0.0001, 1000]}
+        results = {'a': (0.011, 110000), 'b': (0.020, 300000), 'c': (0.0004, 50000), 'd': (1, 1)}
+        self.assertEqual(compare(results, baseline, 0.25),
+                         [('b', 'time', 0.010, 0.020), ('b', 'memory', 100000, 300000)])
+
+    def test_run_benchmarks(self):
+        results = run_benchmarks(['calm'], ['compact'], [(120, 90)], ['raster'], 1, (12, 48))
+        self.assertIn('calm/compact/wx_stream', results)
+        self.assertIn('calm/raster/120x90/render_wind', results)
+        self.assertIn('calm/raster/120x90/quantize_nearest', results)
+        self.assertIn('calm/raster/120x90/48h/window', results)
+
+if __name__ == '__main__':
+    sys.exit(run())
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+
+import json
+import os
+import tempfile
+import unittest
+from collections import namedtuple
+
+FetchResult = namedtuple('FetchResult', ['modified', 'headers'])
+
+CHUNK_SIZE = 16384
+
+class fetch_error(Exception):
+    pass
+
+COMPACT_FIELDS = frozenset([
+    'air_pressure_at_sea_level',
+    'air_temperature',
+    'cloud_area_fraction',
+    'relative_humidity',
+    'wind_from_direction',
+    'wind_speed',
+    'precipitation_amount',
+    'symbol_code'
+])
+
+def choose_endpoint(preference, fields):
+    if preference == 'auto':
+        return 'compact' if set(fields) <= COMPACT_FIELDS else 'complete'
+    if preference not in ('compact', 'complete'):
+        raise ValueError("Unknown endpoint {}".format(preference))
+    return preference
+
+def forecast_url(lat, long, endpoint = 'complete'):
+    return 'https://api.met.no/weatherapi/locationforecast/2.0/{endpoint:}?lat={lat:}&lon={lon:}'.format(endpoint=endpoint, lat=lat, lon=long)
+
+def _write_atomic(path, chunks):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+class forecast_cache:
+    def __init__(self, directory):
+        self.directory = directory
+        self.body_file = os.path.join(directory, 'forecast.json')
+        self.meta_file = os.path.join(directory, 'headers.json')
+
+    def _load_meta(self, url):
+        try:
+            with open(self.meta_file) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta.get('url') != url:
+            return None
+        return meta
+
+    def headers(self, url):
+        meta = self._load_meta(url)
+        if meta is None or not os.path.exists(self.body_file):
+            return None
+        return meta['headers']
+
+    def chunks(self, size = CHUNK_SIZE):
+        with open(self.body_file, 'rb') as f:
+            while True:
+                chunk = f.read(size)
+                if not chunk:
+                    return
+                yield chunk
+
+    def store(self, url, chunks, headers):
+        os.makedirs(self.directory, exist_ok=True)
+        if chunks is not None:
+            _write_atomic(self.body_file, chunks)
+        meta = {'url': url, 'headers': headers}
+        _write_atomic(self.meta_file, [json.dumps(meta).encode()])
+
+    def update_headers(self, url, headers):
+        meta = self._load_meta(url)
+        if meta is None:
+            return None
+        meta['headers'].update(headers)
+        self.store(url, None, meta['headers'])
+        return meta['headers']
+
+    def conditional_headers(self, url):
+        cached = self.headers(url)
+        if cached is None:
+            return {}
+        headers = {}
+        if 'last-modified' in cached:
+            headers['If-Modified-Since'] = cached['last-modified']
+        if 'etag' in cached:
+            headers['If-None-Match'] = cached['etag']
+        return headers
+
+def fetch_forecast(http, url, user_agent, cache):
+    request_headers = {"User-Agent": user_agent, "Accept-Encoding": "gzip"}
+    request_headers.update(cache.conditional_headers(url))
+    response = http.request(method='GET', url=url, headers=request_headers, preload_content=False)
+    try:
+        headers = {k.lower(): v for k, v in response.headers.items()
+                   if k.lower() not in ('content-encoding', 'content-length')}
+        if response.status == 304:
+            merged = cache.update_headers(url, headers)
+            if merged is None:
+                raise fetch_error("Got 304 for {} without a cached forecast".format(url))
+            return FetchResult(False, merged)
+        if response.status not in (200, 203):
+            raise fetch_error("Got status {} for {}".format(response.status, url))
+        cache.store(url, response.stream(CHUNK_SIZE), headers)
+        return FetchResult(True, headers)
+    finally:
+        response.release_conn()
+
+class Test_endpoint(unittest.TestCase):
+    def test_auto_selects_compact_when_possible(self):
+        self.assertEqual(choose_endpoint('auto', ['air_temperature', 'symbol_code']), 'compact')
+        self.assertEqual(choose_endpoint('auto', ['air_temperature', 'wind_speed_percentile_90']), 'complete')
+
+    def test_explicit_endpoint(self):
+        self.assertEqual(choose_endpoint('compact', ['wind_speed_percentile_90']), 'compact')
+        self.assertRaises(ValueError, choose_endpoint, 'full', [])
+
+class Test_forecast_cache(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.cache = forecast_cache(self.dir.name)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_empty_cache(self):
+        self.assertIsNone(self.cache.headers('url'))
+        self.assertEqual(self.cache.conditional_headers('url'), {})
+
+    def test_store_and_load(self):
+        headers = {'expires': 'Tue, 25 Jun 2024 05:22:48 GMT',
+                   'last-modified': 'Tue, 25 Jun 2024 04:52:48 GMT',
+                   'etag': '"abc"'}
+        self.cache.store('url', [b'{"a":', b' 1}'], headers)
+        self.assertEqual(self.cache.headers('url'), headers)
+        self.assertEqual(b''.join(self.cache.chunks(3)), b'{"a": 1}')
+        self.assertEqual(self.cache.conditional_headers('url'),
+                         {'If-Modified-Since': 'Tue, 25 Jun 2024 04:52:48 GMT',
+                          'If-None-Match': '"abc"'})
+
+    def test_other_location_is_not_used(self):
+        self.cache.store('url', [b'{}'], {'etag': '"abc"'})
+        self.assertIsNone(self.cache.headers('other'))
+        self.assertEqual(self.cache.conditional_headers('other'), {})
+
+    def test_update_headers_keeps_body(self):
+        self.cache.store('url', [b'{}'], {'expires': 'a', 'etag': '"abc"'})
+        self.cache.update_headers('url', {'expires': 'b'})
+        self.assertEqual(self.cache.headers('url'), {'expires': 'b', 'etag': '"abc"'})
+        self.assertEqual(b''.join(self.cache.chunks()), b'{}')
+
+    def test_overlapping_stores_use_their_own_files(self):
+        def slow():
+            yield b'{"old":'
+            self.cache.store('url', [b'{"new": 1}'], {'etag': '"new"'})
+            yield b' 0}'
+        self.cache.store('url', slow(), {'etag': '"old"'})
+        self.assertEqual(b''.join(self.cache.chunks()), b'{"old": 0}')
+        self.assertEqual(self.cache.headers('url'), {'etag': '"old"'})
+        self.assertEqual(sorted(os.listdir(self.dir.name)), ['forecast.json', 'headers.json'])
+
+if __name__ == '__main__':
+    unittest.main()
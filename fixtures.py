@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+
+import json
+import math
+import random
+import unittest
+from datetime import datetime, timedelta
+import pytz
+
+import fetch
+import wx_data
+
+START = datetime(2024, 6, 25, 0, 0, 0, 0, pytz.utc)
+HOURLY = 60
+SIX_HOURLY = 20
+
+def calm(h, rnd):
+    return {
+        'air_temperature': 15 + 3*math.sin(h/24*2*math.pi) + rnd.uniform(-0.3, 0.3),
+        'wind_speed': rnd.uniform(0, 0.8),
+        'wind_from_direction': rnd.uniform(0, 360),
+        'precipitation_amount': 0.0,
+        'symbol_code': 'clearsky_day' if 6 <= h % 24 < 21 else 'clearsky_night'
+    }
+
+def heavy_rain(h, rnd):
+    rain = max(0.0, 12 + 10*math.sin(h/5) + rnd.uniform(-3, 3))
+    return {
+        'air_temperature': 12 + rnd.uniform(-1, 1),
+        'wind_speed': 6 + rnd.uniform(-2, 2),
+        'wind_from_direction': 200 + rnd.uniform(-20, 20),
+        'precipitation_amount': round(rain, 1),
+        'symbol_code': 'heavyrain' if rain > 4 else 'rain'
+    }
+
+def high_wind(h, rnd):
+    return {
+        'air_temperature': 8 + rnd.uniform(-2, 2),
+        'wind_speed': 25 + 15*math.sin(h/7) + rnd.uniform(-3, 3),
+        'wind_from_direction': (h*17) % 360,
+        'precipitation_amount': round(rnd.uniform(0, 2), 1),
+        'symbol_code': 'rainshowers_day'
+    }
+
+def large_range(h, rnd):
+    return {
+        'air_temperature': -25 + 60*((h % 12)/11) + rnd.uniform(-0.5, 0.5),
+        'wind_speed': rnd.uniform(2, 12),
+        'wind_from_direction': rnd.uniform(0, 360),
+        'precipitation_amount': round(rnd.uniform(0, 1), 1) if h % 5 == 0 else 0.0,
+        'symbol_code': 'partlycloudy_day'
+    }
+
+def polar_night(h, rnd):
+    return {
+        'air_temperature': -28 + rnd.uniform(-2, 2),
+        'wind_speed': rnd.uniform(1, 5),
+        'wind_from_direction': rnd.uniform(0, 360),
+        'precipitation_amount': round(rnd.uniform(0, 0.4), 1),
+        'symbol_code': 'clearsky_polartwilight' if h % 24 == 12 else 'lightsnow'
+    }
+
+SCENARIOS = {
+    'calm': calm,
+    'heavy_rain': heavy_rain,
+    'high_wind': high_wind,
+    'large_range': large_range,
+    'polar_night': polar_night
+}
+
+def entry(time, values, endpoint, hours):
+    instant = {
+        'air_pressure_at_sea_level': 1013.2,
+        'air_temperature': round(values['air_temperature'], 1),
+        'cloud_area_fraction': 50.0,
+        'relative_humidity': 80.0,
+        'wind_from_direction': round(values['wind_from_direction'], 1),
+        'wind_speed': round(values['wind_speed'], 1)
+    }
+    if endpoint == 'complete':
+        instant.update({
+            'air_temperature_percentile_10': round(values['air_temperature'] - 1, 1),
+            'air_temperature_percentile_90': round(values['air_temperature'] + 1, 1),
+            'dew_point_temperature': round(values['air_temperature'] - 4, 1),
+            'fog_area_fraction': 0.0,
+            'ultraviolet_index_clear_sky': 0.0,
+            'wind_speed_of_gust': round(values['wind_speed']*1.5, 1),
+            'wind_speed_percentile_10': round(values['wind_speed']*0.7, 1),
+            'wind_speed_percentile_90': round(values['wind_speed']*1.3, 1)
+        })
+    period = {'summary': {'symbol_code': values['symbol_code']},
+              'details': {'precipitation_amount': values['precipitation_amount']*hours}}
+    if endpoint == 'complete':
+        period['details'].update({
+            'precipitation_amount_min': round(values['precipitation_amount']*hours*0.5, 1),
+            'precipitation_amount_max': round(values['precipitation_amount']*hours*1.8, 1),
+            'probability_of_precipitation': 80.0 if values['precipitation_amount'] else 0.0
+        })
+    data = {'instant': {'details': instant}, 'next_6_hours': period, 'next_12_hours': {'summary': period['summary']}}
+    if hours == 1:
+        data['next_1_hours'] = period
+    return {'time': time.strftime('%Y-%m-%dT%H:%M:%SZ'), 'data': data}
+
+def forecast_document(scenario, endpoint = 'complete', start = START):
+    rnd = random.Random(scenario)
+    timeseries = [entry(start + timedelta(hours=h), SCENARIOS[scenario](h, rnd), endpoint, 1)
+                  for h in range(HOURLY)]
+    timeseries += [entry(start + timedelta(hours=HOURLY + 6*i), SCENARIOS[scenario](HOURLY + 6*i, rnd), endpoint, 6)
+                   for i in range(SIX_HOURLY)]
+    return {
+        'type': 'Feature',
+        'geometry': {'type': 'Point', 'coordinates': [10.75, 59.91, 10]},
+        'properties': {
+            'meta': {'updated_at': start.strftime('%Y-%m-%dT%H:%M:%SZ'), 'units': {}},
+            'timeseries': timeseries
+        }
+    }
+
+def forecast_bytes(scenario, endpoint = 'complete', start = START):
+    return json.dumps(forecast_document(scenario, endpoint, start)).encode()
+
+def headers(start = START):
+    return {'expires': (start + timedelta(minutes=30)).strftime('%a, %d %b %Y %H:%M:%S GMT')}
+
+class Test_fixtures(unittest.TestCase):
+    def test_fixtures_are_deterministic(self):
+        self.assertEqual(forecast_bytes('high_wind'), forecast_bytes('high_wind'))
+
+    def test_fixtures_parse(self):
+        for scenario in SCENARIOS:
+            for endpoint in ['complete', 'compact']:
+                forecast = wx_data.wx(forecast_document(scenario, endpoint), headers())
+                self.assertEqual(len(forecast.timestamps), HOURLY + SIX_HOURLY)
+                self.assertEqual(len(forecast.predictions(START + timedelta(minutes=30)).sequence), 12)
+
+    def test_compact_fixture_has_compact_fields(self):
+        details = forecast_document('calm', 'compact')['properties']['timeseries'][0]['data']['instant']['details']
+        self.assertTrue(set(details) <= fetch.COMPACT_FIELDS)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+import hashlib
+import os
+import tempfile
+import unittest
+from PIL import Image
+
+from quantize import quantize_image
+
+def fingerprint(image, border):
+    if image.mode != 'P':
+        image = quantize_image(image)
+    digest = hashlib.sha256(image.tobytes())
+    digest.update('{}x{}:{}'.format(image.width, image.height, border).encode())
+    return digest.hexdigest()
+
+class frame_diff:
+    def __init__(self, state_file):
+        self.state_file = state_file
+        self.pending = None
+        self.skipped = 0
+        try:
+            with open(state_file) as f:
+                self.last = f.read().strip()
+        except OSError:
+            self.last = None
+
+    def changed(self, image, border):
+        self.pending = fingerprint(image, border)
+        if self.pending == self.last:
+            self.skipped += 1
+            return False
+        return True
+
+    def pushed(self):
+        self.last = self.pending
+        directory = os.path.dirname(self.state_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp = self.state_file + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(self.last)
+        os.replace(tmp, self.state_file)
+
+class Test_frame_diff(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.state = os.path.join(self.dir.name, 'frame')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_unchanged_frame_is_skipped(self):
+        frames = frame_diff(self.state)
+        self.assertTrue(frames.changed(Image.new('RGB', (4, 4), 'white'), 'white'))
+        frames.pushed()
+        self.assertFalse(frames.changed(Image.new('RGB', (4, 4), 'white'), 'white'))
+        self.assertTrue(frames.changed(Image.new('RGB', (4, 4), 'white'), 'black'))
+        self.assertEqual(frames.skipped, 1)
+
+    def test_invisible_changes_are_ignored(self):
+        frames = frame_diff(self.state)
+        frames.changed(Image.new('RGB', (4, 4), (250, 250, 250)), 'white')
+        frames.pushed()
+        self.assertFalse(frames.changed(Image.new('RGB', (4, 4), (255, 255, 255)), 'white'))
+
+    def test_not_pushed_frame_is_not_remembered(self):
+        frames = frame_diff(self.state)
+        frames.changed(Image.new('RGB', (4, 4), 'red'), 'white')
+        self.assertTrue(frames.changed(Image.new('RGB', (4, 4), 'red'), 'white'))
+
+    def test_last_frame_survives_restart(self):
+        frames = frame_diff(self.state)
+        frames.changed(Image.new('RGB', (4, 4), 'red'), 'white')
+        frames.pushed()
+        self.assertFalse(frame_diff(self.state).changed(Image.new('RGB', (4, 4), 'red'), 'white'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+
+import math
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import unittest
+from datetime import datetime, timedelta
+import numpy
+import pytz
+
+import wx_data
+
+MAGIC = b'WXHIST01'
+HEADER = struct.Struct('<8sQQ')
+SYMBOL_SLOTS = 256
+SYMBOL_SIZE = 32
+FIELDS = ('air_temperature', 'precipitation_amount', 'precipitation_amount_min', 'precipitation_amount_max',
+          'wind_speed', 'wind_speed_percentile_90', 'wind_from_direction')
+RECORD = numpy.dtype([('issued', '<f8'), ('valid', '<f8'), ('lat', '<f4'), ('long', '<f4'), ('symbol', '<u2')]
+                     + [(field, '<f4') for field in FIELDS])
+RECORDS_OFFSET = HEADER.size + SYMBOL_SLOTS * SYMBOL_SIZE
+
+class forecast_history:
+    def __init__(self, path, capacity = 65536):
+        self.path = path
+        self.lock = threading.Lock()
+        size = RECORDS_OFFSET + capacity * RECORD.itemsize
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            header = os.pread(fd, HEADER.size, 0)
+            if len(header) == HEADER.size and header[:len(MAGIC)] == MAGIC:
+                _, capacity, self.count = HEADER.unpack(header)
+                size = RECORDS_OFFSET + capacity * RECORD.itemsize
+            else:
+                self.count = 0
+                os.ftruncate(fd, 0)
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            self.map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self.capacity = capacity
+        self.records = numpy.frombuffer(self.map, dtype=RECORD, count=capacity, offset=RECORDS_OFFSET)
+        self.symbols = [None]
+        for slot in range(1, SYMBOL_SLOTS):
+            start = HEADER.size + slot * SYMBOL_SIZE
+            name = bytes(self.map[start:start + SYMBOL_SIZE]).rstrip(b'\0')
+            if not name:
+                break
+            self.symbols.append(name.decode())
+        self._write_header()
+
+    def _write_header(self):
+        self.map[:HEADER.size] = HEADER.pack(MAGIC, self.capacity, self.count)
+
+    def _symbol(self, code):
+        if code is None:
+            return 0
+        if code in self.symbols:
+            return self.symbols.index(code)
+        if len(self.symbols) == SYMBOL_SLOTS:
+            return 0
+        start = HEADER.size + len(self.symbols) * SYMBOL_SIZE
+        self.map[start:start + SYMBOL_SIZE] = code.encode()[:SYMBOL_SIZE].ljust(SYMBOL_SIZE, b'\0')
+        self.symbols.append(code)
+        return len(self.symbols) - 1
+
+    def append(self, forecast, lat, long, issued = None):
+        issued = issued or forecast.issued or datetime.now(tz=pytz.UTC)
+        rows = forecast.hourly()
+        if rows == 0:
+            return
+        block = numpy.zeros(rows, dtype=RECORD)
+        block['issued'] = issued.timestamp()
+        block['valid'] = numpy.frombuffer(forecast.timestamps, dtype=numpy.float64)[:rows]
+        block['lat'] = lat
+        block['long'] = long
+        for field in FIELDS:
+            column = forecast.columns.get(field)
+            block[field] = numpy.frombuffer(column, dtype=numpy.float64)[:rows] if column is not None else math.nan
+        with self.lock:
+            block['symbol'] = [self._symbol(forecast.symbol_codes[s]) for s in forecast.symbols[:rows]]
+            if rows > self.capacity:
+                block = block[-self.capacity:]
+                rows = self.capacity
+            start = self.count % self.capacity
+            first = min(rows, self.capacity - start)
+            self.records[start:start + first] = block[:first]
+            self.records[:rows - first] = block[first:]
+            self.count += rows
+            self._write_header()
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def _select(self, mask):
+        return self.records[:len(self)][mask]
+
+    def _at(self, lat, long):
+        records = self.records[:len(self)]
+        return (records['lat'] == numpy.float32(lat)) & (records['long'] == numpy.float32(long))
+
+    def forecasts_for(self, lat, long, valid):
+        with self.lock:
+            records = self.records[:len(self)]
+            found = self._select(self._at(lat, long) & (records['valid'] == valid.timestamp()))
+        return numpy.sort(found, order='issued')
+
+    def observed(self, lat, long, since):
+        with self.lock:
+            records = self.records[:len(self)]
+            found = self._select(self._at(lat, long) & (records['valid'] >= since.timestamp()) & (records['valid'] >= records['issued'] - 3600))
+        found = found[numpy.lexsort((found['valid'] - found['issued'], found['valid']))]
+        if len(found) == 0:
+            return found
+        first = numpy.concatenate(([True], found['valid'][1:] != found['valid'][:-1]))
+        return found[first]
+
+    def view(self):
+        records = self.records[:len(self)]
+        records.flags.writeable = False
+        return records
+
+    def symbol(self, index):
+        return self.symbols[index]
+
+    def close(self):
+        self.records = None
+        self.map.close()
+
+class Test_history(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'history')
+        self.start = datetime(2024, 6, 25, 0, 0, 0, 0, pytz.utc)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def forecast(self, issued_hour, offset):
+        timeseries = [wx_data._entry((self.start + timedelta(hours=h)).strftime('%Y-%m-%dT%H:%M:%SZ'), h + offset)
+                      for h in range(issued_hour, issued_hour + 6)]
+        issued = (self.start + timedelta(hours=issued_hour)).strftime('%a, %d %b %Y %H:%M:%S GMT')
+        return wx_data.wx({'properties': {'timeseries': timeseries}}, {'expires': issued, 'last-modified': issued})
+
+    def test_forecasts_for_hour(self):
+        history = forecast_history(self.path, 100)
+        for hour in range(3):
+            history.append(self.forecast(hour, 10*hour), 59.9, 10.7)
+        found = history.forecasts_for(59.9, 10.7, self.start + timedelta(hours=4))
+        self.assertEqual(list(found['air_temperature']), [4, 14, 24])
+        self.assertEqual(history.symbol(found['symbol'][0]), 'fog')
+        self.assertEqual(len(history.forecasts_for(60.0, 10.7, self.start + timedelta(hours=4))), 0)
+        history.close()
+
+    def test_observed_uses_the_latest_forecast(self):
+        history = forecast_history(self.path, 100)
+        for hour in range(3):
+            history.append(self.forecast(hour, 10*hour), 59.9, 10.7)
+        observed = history.observed(59.9, 10.7, self.start)
+        self.assertEqual(list(observed['air_temperature']), [0, 11, 22, 23, 24, 25, 26, 27])
+        history.close()
+
+    def test_ring_buffer_wraps_and_survives_reopen(self):
+        history = forecast_history(self.path, 10)
+        for hour in range(3):
+            history.append(self.forecast(hour, 10*hour), 59.9, 10.7)
+        self.assertEqual(len(history), 10)
+        history.close()
+        history = forecast_history(self.path, 1000)
+        self.assertEqual(history.capacity, 10)
+        self.assertEqual(os.path.getsize(self.path), RECORDS_OFFSET + 10 * RECORD.itemsize)
+        found = history.forecasts_for(59.9, 10.7, self.start + timedelta(hours=3))
+        self.assertEqual(list(found['air_temperature']), [13, 23])
+        self.assertEqual(len(history.forecasts_for(59.9, 10.7, self.start + timedelta(hours=1))), 0)
+        history.close()
+
+    def test_forecast_longer_than_the_ring(self):
+        history = forecast_history(self.path, 4)
+        history.append(self.forecast(0, 0), 59.9, 10.7)
+        self.assertEqual(len(history), 4)
+        self.assertEqual(len(history.forecasts_for(59.9, 10.7, self.start + timedelta(hours=1))), 0)
+        self.assertEqual(list(history.forecasts_for(59.9, 10.7, self.start + timedelta(hours=5))['air_temperature']), [5])
+        history.append(self.forecast(1, 10), 59.9, 10.7)
+        self.assertEqual(len(history.forecasts_for(59.9, 10.7, self.start + timedelta(hours=2))), 0)
+        self.assertEqual(list(history.forecasts_for(59.9, 10.7, self.start + timedelta(hours=6))['air_temperature']), [16])
+        history.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+import base64
+import io
+import os
+import tempfile
+import unittest
+from collections import OrderedDict
+from PIL import Image
+
+from quantize import palette_image
+
+def rasterize_svg(path, size):
+    from cairosvg import svg2png
+    png = svg2png(url=path, unsafe=True, output_width=size, output_height=size)
+    return Image.open(io.BytesIO(png)).convert('RGBA')
+
+def apply_palette(icon, palette):
+    quantized = icon.convert('RGB').quantize(palette=palette_image(palette), dither=Image.Dither.FLOYDSTEINBERG).convert('RGBA')
+    quantized.putalpha(icon.getchannel('A'))
+    return quantized
+
+class icon_cache:
+    def __init__(self, directory, store = None, max_entries = 200, rasterize = rasterize_svg):
+        self.directory = directory
+        self.store = store
+        self.max_entries = max_entries
+        self.rasterize = rasterize
+        self.entries = OrderedDict()
+        self.hrefs = {}
+
+    def _store_name(self, symbol, size, palette):
+        suffix = '_{:08x}'.format(hash(palette) & 0xffffffff) if palette else ''
+        return os.path.join(self.store, '{}_{}{}.png'.format(symbol, size, suffix))
+
+    def _load(self, symbol, size, palette):
+        if self.store:
+            try:
+                with Image.open(self._store_name(symbol, size, palette)) as stored:
+                    return stored.convert('RGBA')
+            except OSError:
+                pass
+        try:
+            icon = self.rasterize(os.path.join(self.directory, '{}.svg'.format(symbol)), size)
+        except OSError:
+            return None
+        if palette:
+            icon = apply_palette(icon, palette)
+        if self.store:
+            os.makedirs(self.store, exist_ok=True)
+            icon.save(self._store_name(symbol, size, palette))
+        return icon
+
+    def get(self, symbol, size, palette = None):
+        key = (symbol, size, palette)
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        icon = self._load(symbol, size, palette)
+        self.entries[key] = icon
+        if len(self.entries) > self.max_entries:
+            evicted, _ = self.entries.popitem(last=False)
+            self.hrefs.pop(evicted, None)
+        return icon
+
+    def href(self, symbol, size, palette = None):
+        icon = self.get(symbol, size, palette)
+        key = (symbol, size, palette)
+        if key not in self.hrefs:
+            if icon is None:
+                return ''
+            png = io.BytesIO()
+            icon.save(png, 'PNG')
+            self.hrefs[key] = 'data:image/png;base64,' + base64.b64encode(png.getvalue()).decode()
+        return self.hrefs[key]
+
+class Test_icon_cache(unittest.TestCase):
+    def setUp(self):
+        self.rendered = []
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def rasterize(self, path, size):
+        self.rendered.append((os.path.basename(path), size))
+        if 'missing' in path:
+            raise FileNotFoundError(path)
+        return Image.new('RGBA', (size, size), (255, 0, 0, 255))
+
+    def test_rasterizes_each_icon_once(self):
+        cache = icon_cache('weather/svg', rasterize=self.rasterize)
+        for _ in range(3):
+            self.assertEqual(cache.get('fog', 10).size, (10, 10))
+            cache.get('fog', 60)
+        self.assertEqual(self.rendered, [('fog.svg', 10), ('fog.svg', 60)])
+
+    def test_least_recently_used_is_evicted(self):
+        cache = icon_cache('weather/svg', max_entries=2, rasterize=self.rasterize)
+        cache.get('fog', 10)
+        cache.get('rain', 10)
+        cache.get('fog', 10)
+        cache.get('snow', 10)
+        self.assertEqual(list(cache.entries), [('fog', 10, None), ('snow', 10, None)])
+
+    def test_missing_icon(self):
+        cache = icon_cache('weather/svg', rasterize=self.rasterize)
+        self.assertIsNone(cache.get('missing', 10))
+        self.assertEqual(cache.href('missing', 10), '')
+        self.assertEqual(len(self.rendered), 1)
+
+    def test_disk_store(self):
+        cache = icon_cache('weather/svg', store=self.dir.name, rasterize=self.rasterize)
+        cache.get('fog', 10)
+        cache = icon_cache('weather/svg', store=self.dir.name, rasterize=self.rasterize)
+        self.assertEqual(cache.get('fog', 10).getpixel((0, 0)), (255, 0, 0, 255))
+        self.assertEqual(len(self.rendered), 1)
+
+    def test_palette(self):
+        cache = icon_cache('weather/svg', rasterize=self.rasterize)
+        icon = cache.get('fog', 4, ((0, 0, 0), (250, 10, 10)))
+        self.assertEqual(icon.getpixel((0, 0)), (250, 10, 10, 255))
+        self.assertTrue(cache.href('fog', 4).startswith('data:image/png;base64,'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+import math
+import unittest
+from datetime import datetime, timedelta
+import pytz
+
+TICK_STEPS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000]
+MIN_TICK_SPACING = 18
+LABEL_CHAR_WIDTH = 9
+
+def tick_step(pixels_per_unit, min_spacing = MIN_TICK_SPACING, smallest = 0):
+    for step in TICK_STEPS:
+        if step >= smallest and step*pixels_per_unit >= min_spacing:
+            return step
+    return TICK_STEPS[-1]
+
+def ticks(low, high, step):
+    import numpy
+    return numpy.arange(math.ceil(low/step)*step, high, step)
+
+def label_stride(labels, spacing):
+    width = max((len(label) for label in labels), default=0)*LABEL_CHAR_WIDTH
+    return max(1, math.ceil(width/spacing))
+
+class window_layout:
+    def __init__(self, sequence, now: datetime, graph, columns, step, limits, height, key = None):
+        import numpy
+        self.key = key
+        left, base, graph_width, graph_height = graph
+        min_temp, max_temp, rain_multiplier = limits
+        temp_range = max_temp - min_temp
+        count = len(sequence)
+        column_width = graph_width/(columns - 1)
+        hour_width = graph_width/columns
+        scale = graph_height/temp_range
+
+        def h2x(h):
+            return h*graph_width/(columns - 1) + left
+
+        def temp2y(temp):
+            return base - scale*(temp - min_temp)
+
+        def rain2y(mm):
+            return temp2y(mm*rain_multiplier + min_temp)
+
+        x = h2x(numpy.arange(count))
+        temperature = numpy.asarray(sequence.column('air_temperature'), dtype=numpy.float64)
+        expected = numpy.asarray(sequence.column('precipitation_amount'), dtype=numpy.float64)
+        low = numpy.asarray(sequence.column('precipitation_amount_min'), dtype=numpy.float64)
+        high = numpy.asarray(sequence.column('precipitation_amount_max'), dtype=numpy.float64)
+        temp_y = temp2y(temperature)
+
+        self.x = x.tolist()
+        self.temp_y = temp_y.tolist()
+
+        self.rain_zero = rain2y(0)
+        self.rain_y = rain2y(expected).tolist()
+        self.rain_top = rain2y(high).tolist()
+        self.rain_bottom = rain2y(low).tolist()
+        bars = numpy.zeros(count, dtype=bool)
+        bars[1:] = (high[1:] > 0) | (expected[:-1] > 0)
+        ranges = numpy.zeros(count, dtype=bool)
+        ranges[1:] = (expected[:-1] > 0) | (expected[1:] > 0)
+        mins = numpy.zeros(count, dtype=bool)
+        mins[1:] = (low[:-1] > 0) | (low[1:] > 0)
+        self.bars = numpy.flatnonzero(bars).tolist()
+        self.ranges = (bars & ranges).tolist()
+        self.mins = (bars & mins).tolist()
+
+        self.icon_size = hour_width
+        self.icon_x = (x - hour_width/2).tolist()
+        self.icon_y = numpy.where(temp_y > height/2, temp_y - 1.5*hour_width, temp_y + hour_width).tolist()
+        self.symbols = sequence.symbols()
+
+        self.wind_x = (x - 2).tolist()
+        self.wind_y = base + 14
+        self.wind_speed = numpy.asarray(sequence.column('wind_speed_percentile_90'), dtype=numpy.float64).tolist()
+        self.wind_direction = numpy.asarray(sequence.column('wind_from_direction'), dtype=numpy.float64).tolist()
+
+        self.grid_x = h2x(numpy.arange(1, columns - 1)).tolist()
+        self.temp_ticks = ticks(min_temp, max_temp, tick_step(scale)).tolist()
+        self.temp_tick_y = temp2y(numpy.asarray(self.temp_ticks, dtype=numpy.float64)).tolist()
+        rain_step = tick_step(scale*rain_multiplier, smallest=0.999/rain_multiplier)
+        self.rain_ticks = ticks(0, math.ceil(temp_range/rain_multiplier), rain_step).tolist()
+        self.rain_tick_y = rain2y(numpy.asarray(self.rain_ticks, dtype=numpy.float64)).tolist()
+
+        if count > 0:
+            now = sequence.time(0).astimezone()
+        label = "%a" if step >= 24 else "%H"
+        labels = [datetime.strftime(now + timedelta(hours=h*step), label) for h in range(columns)]
+        stride = label_stride(labels, column_width)
+        self.hour_x = (h2x(numpy.arange(0, columns, stride)) - 10).tolist()
+        self.hour_labels = labels[::stride]
+
+class Test_layout(unittest.TestCase):
+    def test_tick_step(self):
+        self.assertEqual(tick_step(30), 1)
+        self.assertEqual(tick_step(10), 2)
+        self.assertEqual(tick_step(1), 20)
+        self.assertEqual(tick_step(30, smallest=5), 5)
+
+    def test_ticks(self):
+        self.assertEqual(ticks(-7, 8, 5).tolist(), [-5, 0, 5])
+        self.assertEqual(ticks(-3, 2, 1).tolist(), [-3, -2, -1, 0, 1])
+
+    def test_large_range_is_thinned(self):
+        import render_svg
+        import wx_data
+        from colors import colors
+        start = datetime(2024, 6, 25, 0, 0, 0, 0, pytz.utc)
+        forecast = wx_data._chart_forecast(12, temp=lambda h: -25 + 5*h, rain=lambda h: h % 2, rain_max=lambda h: h % 3)
+        renderer = render_svg.renderer((600, 448), 'Test', colors({}))
+        renderer._get_limits(renderer.window(forecast, start))
+        layout = renderer.get_layout(start)
+        self.assertEqual(layout.temp_ticks, [-25, -20, -15, -10, -5, 0, 5, 10, 15, 20, 25])
+        self.assertEqual(layout.rain_ticks, [0, 1, 2])
+        self.assertEqual(layout.bars, [1, 2, 4, 5, 6, 7, 8, 10, 11])
+        self.assertEqual(layout.x[1], renderer.h2x(1))
+        self.assertEqual(layout.temp_y[3], renderer.temp2y(-10))
+        self.assertIs(renderer.get_layout(start), layout)
+
+    def test_empty_window_follows_the_clock(self):
+        import render_svg
+        import wx_data
+        from colors import colors
+        start = datetime(2024, 6, 25, 0, 0, 0, 0, pytz.utc)
+        forecast = wx_data._chart_forecast(1, temp=lambda h: 10, wind=lambda h: 1, rain=lambda h: 0, rain_max=lambda h: 0)
+        renderer = render_svg.renderer((600, 448), 'Test', colors({}))
+        later = start + timedelta(days=1)
+        renderer._get_limits(renderer.window(forecast, later))
+        self.assertEqual(len(renderer.predictions.sequence), 0)
+        first = renderer.get_layout(later)
+        self.assertIsNot(renderer.get_layout(later + timedelta(hours=1)), first)
+        self.assertIs(renderer.get_layout(later + timedelta(hours=1)), renderer.layout)
+
+    def test_label_stride(self):
+        self.assertEqual(label_stride(['01', '02'], 46), 1)
+        self.assertEqual(label_stride(['Mon', 'Tue'], 24), 2)
+
+if __name__ == '__main__':
+    unittest.main()
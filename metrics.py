@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+
+import cProfile
+import os
+import resource
+import signal
+import syslog
+import threading
+import time
+import tracemalloc
+import unittest
+from contextlib import contextmanager
+from datetime import datetime
+
+PREFIX = 'inkywx_'
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels) + '}'
+
+def event(name, level = syslog.LOG_INFO, **fields):
+    syslog.syslog(level, ' '.join(['event={}'.format(name)] + ['{}={}'.format(k, v) for k, v in fields.items()]))
+
+def rss_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+class registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.gauge_functions = {}
+        self.spans = {}
+        self.samples = {}
+        self.local = threading.local()
+        self.profiles = None
+        self.profile_dir = '.'
+        self.gauge_function('rss_bytes', rss_bytes)
+
+    def inc(self, name, value = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def gauge(self, name, value, **labels):
+        with self.lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def gauge_function(self, name, function):
+        with self.lock:
+            self.gauge_functions[name] = function
+
+    def keep_samples(self, *names):
+        with self.lock:
+            for name in names:
+                self.samples.setdefault(name, [])
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+            self.gauges = {}
+            self.spans = {}
+            self.samples = {name: [] for name in self.samples}
+
+    def record(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            count, total, longest = self.spans.get(key, (0, 0.0, 0.0))
+            self.spans[key] = (count + 1, total + seconds, max(longest, seconds))
+            if name in self.samples:
+                self.samples[name].append(seconds)
+
+    def timed(self, name, function, *args, **labels):
+        with self.span(name, **labels):
+            return function(*args)
+
+    @contextmanager
+    def span(self, name, **labels):
+        profile = None
+        if self.profiles is not None and not getattr(self.local, 'profiling', False):
+            profile = cProfile.Profile()
+            self.local.profiling = True
+            profile.enable()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            if profile:
+                profile.disable()
+                self.local.profiling = False
+                with self.lock:
+                    if self.profiles is not None:
+                        self.profiles.append(profile)
+            self.record(name, seconds, **labels)
+            event(name, syslog.LOG_DEBUG, seconds='{:.4f}'.format(seconds), **labels)
+
+    def prometheus(self):
+        with self.lock:
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+            functions = dict(self.gauge_functions)
+            spans = dict(self.spans)
+        lines = []
+        for (name, labels), value in sorted(counters.items()):
+            lines.append('{}{}_total{} {}'.format(PREFIX, name, format_labels(labels), value))
+        for name, function in sorted(functions.items()):
+            try:
+                value = function()
+            except Exception:
+                continue
+            if isinstance(value, dict):
+                for labels, v in value.items():
+                    gauges[(name, labels)] = v
+            else:
+                gauges[(name, ())] = value
+        for (name, labels), value in sorted(gauges.items()):
+            if value is not None:
+                lines.append('{}{}{} {}'.format(PREFIX, name, format_labels(labels), value))
+        for (name, labels), (count, total, longest) in sorted(spans.items()):
+            lines.append('{}{}_seconds_count{} {}'.format(PREFIX, name, format_labels(labels), count))
+            lines.append('{}{}_seconds_sum{} {:.6f}'.format(PREFIX, name, format_labels(labels), total))
+            lines.append('{}{}_seconds_max{} {:.6f}'.format(PREFIX, name, format_labels(labels), longest))
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(self.prometheus())
+        os.replace(tmp, path)
+
+    def profile_name(self, kind, suffix):
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        os.makedirs(self.profile_dir, exist_ok=True)
+        return os.path.join(self.profile_dir, '{}-{}.{}'.format(kind, stamp, suffix))
+
+    def toggle_profile(self):
+        with self.lock:
+            profiles = self.profiles
+            self.profiles = [] if profiles is None else None
+        if profiles is None:
+            event('profile', state='started')
+            return
+        if not profiles:
+            event('profile', state='stopped', spans=0)
+            return
+        import pstats
+        path = self.profile_name('profile', 'prof')
+        pstats.Stats(*profiles).dump_stats(path)
+        event('profile', state='stopped', spans=len(profiles), file=path)
+
+    def toggle_tracemalloc(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+            event('tracemalloc', state='started')
+            return
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        path = self.profile_name('tracemalloc', 'snapshot')
+        snapshot.dump(path)
+        for stat in snapshot.statistics('lineno')[:10]:
+            event('tracemalloc', size=stat.size, count=stat.count, where=stat.traceback[0])
+        event('tracemalloc', state='stopped', file=path)
+
+    def install_signal_handlers(self, loop = None):
+        handlers = [(signal.SIGUSR1, self.toggle_profile), (signal.SIGUSR2, self.toggle_tracemalloc)]
+        for signum, handler in handlers:
+            if loop:
+                loop.add_signal_handler(signum, handler)
+            else:
+                signal.signal(signum, lambda signum, frame, handler=handler: handler())
+
+    def write_metrics(self, handler):
+        body = self.prometheus().encode()
+        handler.send_response(200)
+        handler.send_header('Content-Type', 'text/plain; version=0.0.4')
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def serve(self, host, port):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        metrics = self
+        class handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                metrics.write_metrics(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        httpd = ThreadingHTTPServer((host, port), handler)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        return httpd
+
+default = registry()
+
+inc = default.inc
+gauge = default.gauge
+span = default.span
+timed = default.timed
+write_metrics = default.write_metrics
+
+class Test_metrics(unittest.TestCase):
+    def test_prometheus_text(self):
+        metrics = registry()
+        metrics.inc('fetch', result='modified')
+        metrics.inc('fetch', result='modified')
+        metrics.gauge_function('forecast_age_seconds', lambda: {(('location', '59.9,10.7'),): 12.5})
+        metrics.gauge('frames_cached', 3)
+        metrics.record('render', 0.25, display='hall')
+        metrics.record('render', 0.5, display='hall')
+        text = metrics.prometheus()
+        self.assertIn('inkywx_fetch_total{result="modified"} 2\n', text)
+        self.assertIn('inkywx_forecast_age_seconds{location="59.9,10.7"} 12.5\n', text)
+        self.assertIn('inkywx_frames_cached 3\n', text)
+        self.assertIn('inkywx_render_seconds_count{display="hall"} 2\n', text)
+        self.assertIn('inkywx_render_seconds_sum{display="hall"} 0.750000\n', text)
+        self.assertIn('inkywx_render_seconds_max{display="hall"} 0.500000\n', text)
+        self.assertIn('inkywx_rss_bytes ', text)
+
+    def test_samples_are_kept_when_asked_for(self):
+        metrics = registry()
+        metrics.keep_samples('render')
+        metrics.record('render', 0.25, display='hall')
+        metrics.record('render', 0.5)
+        metrics.record('show', 1.0)
+        self.assertEqual(metrics.samples, {'render': [0.25, 0.5]})
+
+    def test_reset(self):
+        metrics = registry()
+        metrics.keep_samples('render')
+        metrics.inc('frames')
+        metrics.record('render', 0.25)
+        metrics.reset()
+        self.assertEqual((metrics.counters, metrics.spans, metrics.samples), ({}, {}, {'render': []}))
+        self.assertIn('rss_bytes', metrics.gauge_functions)
+
+    def test_span_is_profiled_once_per_thread(self):
+        metrics = registry()
+        metrics.toggle_profile()
+        with metrics.span('outer'):
+            with metrics.span('inner'):
+                pass
+        self.assertEqual(len(metrics.profiles), 1)
+        self.assertEqual(metrics.spans[('inner', ())][0], 1)
+        metrics.profiles = None
+
+if __name__ == '__main__':
+    unittest.main()
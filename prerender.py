@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+
+import json
+import multiprocessing
+import syslog
+import threading
+import unittest
+import zlib
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+import numpy
+import pytz
+
+import icons
+import metrics
+import quantize
+import render_raster
+import render_svg
+import wx_data
+from colors import colors
+
+RendererSpec = namedtuple('RendererSpec', ['backend', 'resolution', 'place', 'colors', 'icon_dir', 'icon_store', 'dithering', 'precision', 'hours'],
+                          defaults=[12])
+
+def make_renderer(spec: RendererSpec):
+    for part in ('chart', 'icons'):
+        if spec.dithering[part] not in quantize.METHODS:
+            raise ValueError("Unknown dithering {} for {}".format(spec.dithering[part], part))
+    icon_cache = icons.icon_cache(spec.icon_dir, spec.icon_store)
+    icon_palette = quantize.PALETTE if spec.dithering['icons'] == 'diffusion' else None
+    color_settings = colors(spec.colors)
+    if spec.backend == 'raster':
+        return render_raster.renderer(spec.resolution, spec.place, color_settings, icon_cache, icon_palette, spec.hours)
+    if spec.backend == 'svg':
+        return render_svg.renderer(spec.resolution, spec.place, color_settings, icon_cache, icon_palette, spec.precision, spec.hours)
+    raise ValueError("Unknown renderer {}".format(spec.backend))
+
+def render_frame(renderer, forecast, now, dithering):
+    with metrics.span('render'):
+        image = renderer.render_image(forecast, now)
+    with metrics.span('quantize'):
+        return quantize.to_image(quantize.quantize(image, dithering))
+
+def pack(frame):
+    return (frame.size, zlib.compress(frame.tobytes(), 1))
+
+def unpack(packed):
+    (width, height), data = packed
+    return quantize.to_image(numpy.frombuffer(zlib.decompress(data), dtype=numpy.uint8).reshape(height, width))
+
+def hour_of(time):
+    return time.replace(minute=0, second=0, microsecond=0)
+
+def spec_key(spec: RendererSpec):
+    return json.dumps(spec, sort_keys=True)
+
+_renderers = {}
+
+def _render_hour(spec, key, forecast, hour):
+    renderer = _renderers.get(key)
+    if renderer is None:
+        renderer = _renderers[key] = make_renderer(spec)
+    frame = render_frame(renderer, forecast, hour + timedelta(seconds=1), spec.dithering['chart'])
+    return hour, pack(frame)
+
+class prerender_job:
+    def __init__(self, forecast, hour, hours):
+        self.forecast = forecast
+        self.hour = hour
+        self.hours = hours
+        self.futures = []
+        self.frames = {}
+
+    def cancel(self):
+        for future in self.futures:
+            future.cancel()
+
+class prerenderer:
+    def __init__(self, workers = 1):
+        self.workers = workers
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('forkserver'))
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def submit(self, location, spec, forecast, now, hours):
+        key = spec_key(spec)
+        hour = hour_of(now)
+        with self.lock:
+            job = self.jobs.get((location, key))
+            if job and job.forecast is forecast and job.hour == hour and job.hours >= hours:
+                metrics.inc('prerender', result='merged')
+                return
+            if job:
+                job.cancel()
+            job = self.jobs[(location, key)] = prerender_job(forecast, hour, hours)
+            for h in range(1, hours + 1):
+                job.futures.append(self.executor.submit(_render_hour, spec, key, forecast, hour + timedelta(hours=h)))
+            metrics.inc('prerender', result='submitted')
+
+    def _collect(self, job):
+        pending = []
+        for future in job.futures:
+            if not future.done():
+                pending.append(future)
+            elif future.cancelled():
+                continue
+            elif future.exception() is not None:
+                syslog.syslog(syslog.LOG_ERR, "Failed to prerender frame, err={!r}".format(future.exception()))
+            else:
+                hour, packed = future.result()
+                job.frames[hour] = packed
+        job.futures = pending
+
+    def frame(self, location, spec, now):
+        with self.lock:
+            job = self.jobs.get((location, spec_key(spec)))
+            if job is None:
+                return None
+            self._collect(job)
+            hour = hour_of(now)
+            for old in [h for h in job.frames if h < hour]:
+                del job.frames[old]
+            packed = job.frames.get(hour)
+        return unpack(packed) if packed else None
+
+    def retain(self, displays):
+        keys = set((location, spec_key(spec)) for location, spec in displays)
+        with self.lock:
+            for key in [key for key in self.jobs if key not in keys]:
+                self.jobs.pop(key).cancel()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+LOCATION = (59.91, 10.75)
+
+class Test_prerender(unittest.TestCase):
+    def forecast(self, symbol = 'fog'):
+        return wx_data._chart_forecast(symbol=symbol)
+
+    def test_packed_frame_roundtrip(self):
+        frame = quantize.to_image(numpy.arange(12, dtype=numpy.uint8).reshape(3, 4) % 7)
+        self.assertEqual(unpack(pack(frame)).tobytes(), frame.tobytes())
+
+    def test_unknown_dithering_is_rejected(self):
+        spec = RendererSpec('raster', (120, 90), 'Test', {}, '/nonexistent', None, {'chart': 'nearest', 'icons': 'fancy'}, 1)
+        with self.assertRaises(ValueError):
+            make_renderer(spec)
+        with self.assertRaises(ValueError):
+            make_renderer(spec._replace(dithering={'chart': 'diffused', 'icons': 'nearest'}))
+
+    def test_prerendered_frames_match_inline_render(self):
+        spec = RendererSpec('raster', (120, 90), 'Test', {}, '/nonexistent', None, {'chart': 'nearest', 'icons': 'nearest'}, 1)
+        forecast = self.forecast()
+        now = datetime(2024, 6, 25, 3, 30, 0, 0, pytz.utc)
+        frames = prerenderer(2)
+        try:
+            frames.submit(LOCATION, spec, forecast, now, 2)
+            for future in frames.jobs[(LOCATION, spec_key(spec))].futures:
+                future.result()
+            later = datetime(2024, 6, 25, 5, 10, 0, 0, pytz.utc)
+            expected = render_frame(make_renderer(spec), forecast, later, 'nearest')
+            self.assertEqual(frames.frame(LOCATION, spec, later).tobytes(), expected.tobytes())
+            self.assertIsNone(frames.frame(LOCATION, spec, datetime(2024, 6, 25, 6, 10, 0, 0, pytz.utc)))
+            self.assertEqual(list(frames.jobs[(LOCATION, spec_key(spec))].frames), [])
+        finally:
+            frames.shutdown()
+
+    def test_forecasts_with_new_symbols(self):
+        spec = RendererSpec('raster', (120, 90), 'Test', {}, '/nonexistent', None, {'chart': 'nearest', 'icons': 'nearest'}, 1)
+        now = datetime(2024, 6, 25, 3, 30, 0, 0, pytz.utc)
+        later = datetime(2024, 6, 25, 4, 10, 0, 0, pytz.utc)
+        frames = prerenderer(1)
+        try:
+            for symbol in ['fog', 'heavyrain']:
+                forecast = self.forecast(symbol)
+                frames.submit(LOCATION, spec, forecast, now, 1)
+                for future in frames.jobs[(LOCATION, spec_key(spec))].futures:
+                    self.assertIsNone(future.exception())
+                expected = render_frame(make_renderer(spec), forecast, later, 'nearest')
+                self.assertEqual(frames.frame(LOCATION, spec, later).tobytes(), expected.tobytes())
+        finally:
+            frames.shutdown()
+
+    def test_duplicate_requests_are_merged(self):
+        spec = RendererSpec('raster', (120, 90), 'Test', {}, '/nonexistent', None, {'chart': 'nearest', 'icons': 'nearest'}, 1)
+        other = spec._replace(place='Other')
+        elsewhere = (60.0, 11.0)
+        forecast = self.forecast()
+        now = datetime(2024, 6, 25, 3, 30, 0, 0, pytz.utc)
+        frames = prerenderer(1)
+        try:
+            frames.submit(LOCATION, spec, forecast, now, 2)
+            first = frames.jobs[(LOCATION, spec_key(spec))]
+            frames.submit(LOCATION, RendererSpec(*spec), forecast, now + timedelta(minutes=10), 2)
+            self.assertIs(frames.jobs[(LOCATION, spec_key(spec))], first)
+            self.assertEqual(len(first.futures), 2)
+            frames.submit(LOCATION, other, forecast, now, 2)
+            frames.submit(elsewhere, spec, self.forecast(), now, 2)
+            self.assertEqual(len(frames.jobs), 3)
+            self.assertIs(frames.jobs[(LOCATION, spec_key(spec))], first)
+            frames.submit(LOCATION, spec, self.forecast(), now, 2)
+            self.assertIsNot(frames.jobs[(LOCATION, spec_key(spec))], first)
+            frames.retain([(LOCATION, spec)])
+            self.assertEqual(list(frames.jobs), [(LOCATION, spec_key(spec))])
+        finally:
+            frames.shutdown()
+
+if __name__ == '__main__':
+    unittest.main()
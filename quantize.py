@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+import unittest
+from functools import lru_cache
+import numpy
+from PIL import Image
+
+PALETTE = (
+    (0, 0, 0),
+    (255, 255, 255),
+    (0, 255, 0),
+    (0, 0, 255),
+    (255, 0, 0),
+    (255, 255, 0),
+    (255, 140, 0)
+)
+
+LUT_BITS = 6
+METHODS = ('nearest', 'diffusion')
+
+def palette_image(palette = PALETTE):
+    image = Image.new('P', (1, 1))
+    flat = [c for color in palette for c in color]
+    image.putpalette(flat + flat[:3] * (256 - len(palette)))
+    return image
+
+@lru_cache(maxsize=4)
+def lookup_table(palette = PALETTE):
+    shift = 8 - LUT_BITS
+    levels = (numpy.arange(1 << LUT_BITS, dtype=numpy.int32) << shift) + (1 << (shift - 1))
+    r, g, b = numpy.meshgrid(levels, levels, levels, indexing='ij')
+    rgb = numpy.stack([r.ravel(), g.ravel(), b.ravel()], axis=1)
+    best = numpy.full(len(rgb), numpy.iinfo(numpy.int32).max, dtype=numpy.int32)
+    table = numpy.zeros(len(rgb), dtype=numpy.uint8)
+    for index, color in enumerate(palette):
+        distance = ((rgb - numpy.array(color, dtype=numpy.int32)) ** 2).sum(axis=1)
+        closer = distance < best
+        best[closer] = distance[closer]
+        table[closer] = index
+    return table
+
+def quantize_nearest(image, palette = PALETTE):
+    shift = 8 - LUT_BITS
+    rgb = numpy.asarray(image.convert('RGB')) >> shift
+    index = (rgb[..., 0].astype(numpy.uint32) << (2 * LUT_BITS)) | (rgb[..., 1].astype(numpy.uint32) << LUT_BITS) | rgb[..., 2]
+    return lookup_table(palette)[index]
+
+def quantize_diffusion(image, palette = PALETTE):
+    quantized = image.convert('RGB').quantize(palette=palette_image(palette), dither=Image.Dither.FLOYDSTEINBERG)
+    indices = numpy.asarray(quantized)
+    return numpy.where(indices < len(palette), indices, 0).astype(numpy.uint8)
+
+def quantize(image, method = 'nearest', palette = PALETTE):
+    if method == 'nearest':
+        return quantize_nearest(image, palette)
+    if method == 'diffusion':
+        return quantize_diffusion(image, palette)
+    raise ValueError("Unknown quantization {}".format(method))
+
+def to_image(indices, palette = PALETTE):
+    image = Image.fromarray(indices, 'P')
+    image.putpalette(palette_image(palette).getpalette())
+    return image
+
+def quantize_image(image, palette = PALETTE):
+    return to_image(quantize_nearest(image, palette), palette)
+
+class Test_quantize(unittest.TestCase):
+    def test_palette_colors_map_to_their_index(self):
+        image = Image.new('RGB', (len(PALETTE), 1))
+        image.putdata(list(PALETTE))
+        for method in ['nearest', 'diffusion']:
+            self.assertEqual(list(quantize(image, method)[0]), list(range(len(PALETTE))))
+
+    def test_nearest_color(self):
+        image = Image.new('RGB', (2, 1))
+        image.putdata([(240, 20, 10), (200, 130, 40)])
+        self.assertEqual(list(quantize(image)[0]), [4, 6])
+
+    def test_diffusion_mixes_colors(self):
+        indices = quantize(Image.new('RGB', (8, 8), (128, 128, 128)), 'diffusion')
+        self.assertGreater(len(set(indices.ravel())), 1)
+
+    def test_lookup_table_is_cached(self):
+        self.assertIs(lookup_table(PALETTE), lookup_table(PALETTE))
+
+    def test_to_image(self):
+        image = to_image(numpy.array([[0, 4]], dtype=numpy.uint8))
+        self.assertEqual(image.mode, 'P')
+        self.assertEqual(image.convert('RGB').getpixel((1, 0)), (255, 0, 0))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+
+import math
+import os
+import unittest
+from datetime import datetime, timedelta
+from PIL import Image, ImageColor, ImageDraw, ImageFont
+import pytz
+
+import render_svg
+import wx_data
+from colors import colors
+from icons import icon_cache
+from render_svg import barb_counts, barb_shapes, mps2knots
+
+FONT = 'DejaVuSans.ttf'
+DEFAULT_FONT_SIZE = 12
+
+def load_font(size):
+    try:
+        return ImageFont.truetype(FONT, size)
+    except OSError:
+        return ImageFont.load_default(size)
+
+class renderer(render_svg.renderer):
+    def __init__(self, resolution, place, colors, icons = None, icon_palette = None, hours = 12):
+        super().__init__(resolution, place, colors, icons, icon_palette, hours=hours)
+        if self.icons is None:
+            self.icons = icon_cache(os.path.join(self.homedir, 'weather', 'svg'))
+        self.fonts = {}
+
+    def font(self, size = DEFAULT_FONT_SIZE):
+        if size not in self.fonts:
+            self.fonts[size] = load_font(size)
+        return self.fonts[size]
+
+    def rgb(self, name, alpha = 255):
+        return ImageColor.getrgb(name)[:3] + (alpha,)
+
+    def text(self, x, y, text, color, size = DEFAULT_FONT_SIZE):
+        self.draw.text((x, y), text, fill=self.rgb(color), font=self.font(size), anchor='ls')
+
+    def paste_icon(self, weather: str, x: float, y: float, size: float):
+        if weather is None:
+            return
+        icon = self.icons.get(weather, round(size), self.icon_palette)
+        if icon is not None:
+            self.image.alpha_composite(icon, (max(0, round(x)), max(0, round(y))))
+
+    def windbarb(self, mps, direction, pos_x, pos_y, scale, color):
+        knots = mps2knots(mps)
+        color = self.rgb(color)
+        if knots <= 2:
+            r = 32*scale
+            self.draw.ellipse((pos_x - r, pos_y - r, pos_x + r, pos_y + r), outline=color, width=2)
+            return
+        angle = math.radians(direction)
+        cos_a = math.cos(angle)*scale
+        sin_a = math.sin(angle)*scale
+        width = max(1, round(3*scale))
+        for points, closed in barb_shapes(barb_counts(knots)):
+            xy = [(pos_x + x*cos_a - y*sin_a, pos_y + x*sin_a + y*cos_a) for x, y in points]
+            if closed or len(xy) > 2:
+                self.draw.polygon(xy, fill=color)
+            self.draw.line(xy + xy[:1] if closed else xy, fill=color, width=width)
+
+    def render_background(self):
+        self.draw.rectangle((0, 0, self.width, self.height), fill=self.rgb(self.colors.background))
+
+    def render_chrome(self):
+        self.render_background()
+        self.text(350, 55, self.place, self.colors.placename, 40)
+
+    def render_hours(self, time: datetime):
+        for x, label in zip(self.layout.hour_x, self.layout.hour_labels):
+            self.text(x, self.top_margin - 5, label, self.colors.hour)
+
+    def render_grid(self):
+        layout = self.layout
+        grid = self.rgb(self.colors.grid)
+        left = self.left_margin
+        right = self.width - self.right_margin
+        top = self.top_margin
+        bottom = self.height - self.bottom_margin
+        self.draw.rectangle((left, top, right, bottom), outline=grid, width=1)
+        for x in layout.grid_x:
+            self.draw.line((x, top, x, bottom), fill=grid, width=1)
+
+        for t, y in zip(layout.temp_ticks, layout.temp_tick_y):
+            self.draw.line((left, y, right, y), fill=grid, width=1)
+            self.text(2, y, '{}°'.format(t), self.colors.temperature)
+
+        for mm, y in zip(layout.rain_ticks, layout.rain_tick_y):
+            self.text(right + 3, y, '{}mm'.format(mm), self.colors.precipitation)
+
+    def render_precipitation(self):
+        layout = self.layout
+        color = self.rgb(self.colors.precipitation)
+        translucent = self.rgb(self.colors.precipitation, 128)
+        for h in layout.bars:
+            x = layout.x[h]
+            prev_x = layout.x[h - 1]
+            top = layout.rain_top[h]
+            bottom = layout.rain_bottom[h]
+            y = layout.rain_y[h]
+            for segment in [(x - 3, top, x + 3, top), (x, top, x, bottom),
+                            (x - 3, bottom, x + 3, bottom), (x - 3, y, x + 3, y)]:
+                self.draw.line(segment, fill=color, width=3)
+            if layout.ranges[h]:
+                self.draw.polygon([(prev_x, layout.rain_bottom[h - 1]),
+                                   (prev_x, layout.rain_y[h - 1]),
+                                   (x, y),
+                                   (x, bottom)],
+                                  fill=translucent, outline=color)
+            if layout.mins[h]:
+                self.draw.polygon([(prev_x, layout.rain_zero),
+                                   (prev_x, layout.rain_bottom[h - 1]),
+                                   (x, bottom),
+                                   (x, layout.rain_zero)],
+                                  fill=color, outline=color)
+
+    def render_temperature(self):
+        points = list(zip(self.layout.x, self.layout.temp_y))
+        if len(points) > 1:
+            self.draw.line(points, fill=self.rgb(self.colors.temperature), width=4, joint='curve')
+
+    def render_sky_icons(self):
+        layout = self.layout
+        for x, y, symbol in zip(layout.icon_x, layout.icon_y, layout.symbols):
+            self.paste_icon(symbol, x, y, layout.icon_size)
+
+    def render_wind(self):
+        layout = self.layout
+        for x, speed, direction in zip(layout.wind_x, layout.wind_speed, layout.wind_direction):
+            self.windbarb(speed, direction, x, layout.wind_y, self.barb_scale, self.colors.wind)
+
+    def render_header(self):
+        current = self.predictions.current.data
+        self.paste_icon(current.get('symbol_code'), 5, 5, 60)
+        self.text(70, 55, '{}°C'.format(self.n(current['air_temperature'])), self.colors.temperature, 55)
+        self.windbarb(current['wind_speed_percentile_90'], current['wind_from_direction'], 300, 35, 0.8, self.colors.wind)
+
+    def layer(self, name, key, renders):
+        cached = self.layer_cache.get(name)
+        if cached is None or cached[0] != key:
+            self.image = Image.new('RGBA', (self.width, self.height), (0, 0, 0, 0))
+            self.draw = ImageDraw.Draw(self.image, 'RGBA')
+            for render in renders:
+                render()
+            cached = self.layer_cache[name] = (key, self.image)
+            self.image = None
+            self.draw = None
+        return cached[1]
+
+    def render_image(self, forecast: wx_data, now: datetime):
+        self._get_limits(self.window(forecast, now))
+        image = Image.new('RGBA', (self.width, self.height), self.rgb(self.colors.background))
+        for layer in self.render_layers(now):
+            image.alpha_composite(layer)
+        return image.convert('RGB')
+
+class Test_raster(unittest.TestCase):
+    def setUp(self):
+        icons = icon_cache('weather/svg', rasterize=lambda path, size: Image.new('RGBA', (size, size), (0, 255, 0, 255)))
+        self.renderer = renderer((600, 448), 'Test', colors({}), icons)
+        start = datetime(2024, 6, 25, 0, 0, 0, 0, pytz.utc)
+        self.now = start + timedelta(hours=3, minutes=30)
+        self.forecast = wx_data._chart_forecast(wind=lambda h: 0.5 + h)
+
+    def blank(self):
+        self.renderer.image = Image.new('RGBA', (100, 100), (0, 0, 0, 0))
+        self.renderer.draw = ImageDraw.Draw(self.renderer.image, 'RGBA')
+        return self.renderer.image
+
+    def test_default_chart(self):
+        image = self.renderer.render_image(self.forecast, self.now)
+        self.assertEqual(image.size, (600, 448))
+        self.assertEqual(image.mode, 'RGB')
+        layout = self.renderer.layout
+        self.assertEqual(image.getpixel((599, 0)), (255, 255, 255))
+        self.assertEqual(image.getpixel((35, 35)), (0, 255, 0))
+        self.assertEqual(image.getpixel((self.renderer.left_margin, self.renderer.top_margin)), (0, 0, 0))
+        middle = ((layout.x[3] + layout.x[4])/2, (layout.temp_y[3] + layout.temp_y[4])/2)
+        self.assertEqual(image.getpixel((round(middle[0]), round(middle[1]))), (255, 0, 0))
+
+    def test_calm_wind_is_a_circle(self):
+        image = self.blank()
+        self.renderer.windbarb(0.5, 90, 50, 50, 0.5, 'black')
+        self.assertEqual(image.getbbox(), (34, 34, 67, 67))
+        self.assertEqual(image.getpixel((34, 50)), (0, 0, 0, 255))
+        self.assertEqual(image.getpixel((50, 50)), (0, 0, 0, 0))
+
+    def test_missing_symbol_is_not_drawn(self):
+        image = self.blank()
+        self.renderer.paste_icon(None, 10, 10, 60)
+        self.assertIsNone(image.getbbox())
+        self.renderer.paste_icon('fog', 10, 10, 20)
+        self.assertEqual(image.getbbox(), (10, 10, 30, 30))
+
+if __name__ == '__main__':
+    unittest.main()
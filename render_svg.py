@@ -4,36 +4,115 @@ import pytz
 
 import wx_data
 from datetime import datetime, timedelta
+import io
 import math
+from bisect import bisect_left
+import unittest
+import xml.etree.ElementTree as ElementTree
+from functools import lru_cache
+from xml.sax.saxutils import escape
 from colors import colors
+from layout import window_layout
+import metrics
 import os
 
-def windbarb(mps, direction, pos_x, pos_y, scale, color):
-    knots = round(mps*3600/1852)
-    if knots <= 2:
-        return '<circle r="{r:}" fill="none" style="stroke:{color:};stroke-width:2" transform="translate({x:} {y:})"/>'.format(x=pos_x,y=pos_y, r=32*scale, color=color)
-    path="M-5 27 L0 32 L5 27 M0 32 L0 -32"
-    base_y = -32
-    delta_y = 12
+def mps2knots(mps):
+    return round(mps*3600/1852)
+
+def barb_counts(knots):
+    flags = barbs = halves = 0
     while knots >= 48:
-        path+= " M0 {b1:} L20 {b2:} L0 {b3:} Z".format(b1=base_y,b2=base_y+5,b3=base_y+10)
-        base_y+= delta_y
+        flags += 1
         knots -= 50
     while knots >= 8:
-        path+= " M0 {b2:} L20 {b1:}".format(b1=base_y, b2=base_y + 5)
-        knots-= 10
-        delta_y = 9
-        base_y+= delta_y
+        barbs += 1
+        knots -= 10
     while knots > 2:
-        path+= " M0 {b2} L10 {b1:}".format(b1=base_y+2,b2=base_y+5)
-        knots-= 5
-        delta_y = 9
-        base_y+= delta_y
-    return '<path d="{path:}" style="stroke:{color:};stroke-width:3" transform="translate({x:} {y:}) rotate({direction:}) scale({scale:})"/>'.format(path=path, x=pos_x, y=pos_y, direction=direction, scale=scale, color=color)
+        halves += 1
+        knots -= 5
+    return flags, barbs, halves
+
+@lru_cache(maxsize=None)
+def barb_shapes(counts):
+    flags, barbs, halves = counts
+    shapes = [((-5, 27), (0, 32), (5, 27)), ((0, 32), (0, -32))]
+    closed = [False, False]
+    base_y = -32
+    for _ in range(flags):
+        shapes.append(((0, base_y), (20, base_y + 5), (0, base_y + 10)))
+        closed.append(True)
+        base_y+= 12
+    for _ in range(barbs):
+        shapes.append(((0, base_y + 5), (20, base_y)))
+        closed.append(False)
+        base_y+= 9
+    for _ in range(halves):
+        shapes.append(((0, base_y + 5), (10, base_y + 2)))
+        closed.append(False)
+        base_y+= 9
+    return tuple(zip(shapes, closed))
+
+def barb_path(counts):
+    return ' '.join(
+        'M{} {}'.format(*points[0]) + ''.join(' L{} {}'.format(*p) for p in points[1:]) + (' Z' if closed else '')
+        for points, closed in barb_shapes(counts))
+
+class barb_defs:
+    def __init__(self, fmt = str):
+        self.fmt = fmt
+        self.symbols = {}
+
+    def use(self, mps, direction, pos_x, pos_y, scale, css_class):
+        knots = mps2knots(mps)
+        if knots <= 2:
+            return '<circle r="{r:}" class="{css:} calm" transform="translate({x:} {y:})"/>'.format(
+                r=self.fmt(32*scale), css=css_class, x=self.fmt(pos_x), y=self.fmt(pos_y))
+        counts = barb_counts(knots)
+        if counts not in self.symbols:
+            self.symbols[counts] = 'b{}-{}-{}'.format(*counts)
+        return '<use href="#{id:}" class="{css:}" transform="translate({x:} {y:}) rotate({direction:}) scale({scale:})"/>'.format(
+            id=self.symbols[counts], css=css_class, x=self.fmt(pos_x), y=self.fmt(pos_y),
+            direction=self.fmt(direction), scale=scale)
+
+    def render(self):
+        return '<defs>{}</defs>'.format(''.join(
+            '<path id="{}" d="{}"/>'.format(symbol, barb_path(counts))
+            for counts, symbol in sorted(self.symbols.items())))
+
+def barb_sheet():
+    barbs = barb_defs()
+    body = []
+    for kts in range(110):
+        x = (kts % 20) * 30 + 10
+        y = math.floor(kts / 20)*4*20+10
+        body.append('<text x="{x:}" y="{y:}">{msg:}</text>'.format(x=x,y=y,msg=kts))
+        body.append(barbs.use(kts*1852/3600, 0, x,y+30, 0.7, 'wind'))
+    return ''.join([
+        '<svg height="448" width="600" xmlns="http://www.w3.org/2000/svg">',
+        '<style>.wind{stroke:black;stroke-width:3}.calm{fill:none;stroke-width:2}</style>',
+        barbs.render(),
+        '\n'.join(body),
+        '</svg>\n'])
 
 class renderer:
-    def __init__(self, resolution, place, colors: colors):
+    fields = (
+        'air_temperature',
+        'precipitation_amount',
+        'precipitation_amount_min',
+        'precipitation_amount_max',
+        'wind_speed_percentile_90',
+        'wind_from_direction',
+        'symbol_code'
+    )
+    hours = 12
+    min_column_width = 24
+
+    def __init__(self, resolution, place, colors: colors, icons = None, icon_palette = None, precision = 1, hours = 12):
+        from series import bucket_size
         self.homedir=os.getcwd()
+        self.precision = precision
+        self.icons = icons
+        self.icon_palette = icon_palette
         self.width = resolution[0]
         self.height = resolution[1]
         self.top_margin = self.height/4.5
@@ -46,23 +125,27 @@ class renderer:
         self.graph_width = self.width - self.left_margin - self.right_margin
         self.graph_height = self.height - self.top_margin - self.bottom_margin
 
-        self.hour_width = self.graph_width/12
+        self.hours = hours
+        self.step = bucket_size(hours, max(2, int(self.graph_width//self.min_column_width)))
+        self.columns = max(2, hours//self.step)
+        self.hour_width = self.graph_width/self.columns
+        self.barb_scale = min(0.4, round(self.hour_width/100, 2))
 
         self.place = place
+        self.layer_cache = {}
+        self.layout = None
+        self.style = self.render_style()
+        self.barbs = barb_defs(self.n)
 
     def _get_limits(self, predictions):
 
-        min_temp = 10000
-        max_temp = -10000
-        max_rain = 0
-        time=None
-        for prediction in predictions.sequence:
-            if time == None:
-                time = prediction[0].astimezone()
-            temp = prediction[1]['air_temperature']
-            min_temp = min(min_temp, math.floor(temp))
-            max_temp = max(max_temp, math.ceil(temp))
-            max_rain = max(max_rain, math.ceil(prediction[1]['precipitation_amount_max']))
+        import numpy
+        temps = numpy.asarray(predictions.sequence.column('air_temperature'), dtype=numpy.float64)
+        rain = numpy.asarray(predictions.sequence.column('precipitation_amount_max'), dtype=numpy.float64)
+        known = not numpy.isnan(temps).all()
+        min_temp = math.floor(numpy.nanmin(temps)) if known else 10000
+        max_temp = math.ceil(numpy.nanmax(temps)) if known else -10000
+        max_rain = math.ceil(numpy.nanmax(rain)) if not numpy.isnan(rain).all() else 0
         temp_range = max_temp - min_temp
         rain_multipliers = [0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50]
         rain_multiplier = 1
@@ -78,7 +161,7 @@ class renderer:
         self.predictions = predictions
 
     def h2x(self, h: float):
-        return h*self.graph_width/11+self.left_margin
+        return h*self.graph_width/(self.columns-1)+self.left_margin
 
     def temp2y(self, temp: float):
         return self.height - self.bottom_margin - self.graph_height/self.temp_range * (temp - self.min_temp)
@@ -86,198 +169,238 @@ class renderer:
     def rain2y(self, mm: float):
         return self.temp2y(mm * self.rain_multiplier + self.min_temp)
 
-    def get_icon(self, weather: str):
+    def get_icon(self, weather: str, size: float = None):
+        if self.icons and size:
+            return self.icons.href(weather, round(size), self.icon_palette)
         return 'file:{}/weather/svg/{}.svg'.format(
             self.homedir,
             weather
         )
 
+    def n(self, value: float):
+        return '{:g}'.format(round(value, self.precision))
+
+    def render_style(self):
+        return ('<style>'
+                'text{{fill:{hour:}}}'
+                '.frame{{fill:none;stroke:{grid:};stroke-width:1}}'
+                '.grid{{stroke:{grid:};stroke-width:1}}'
+                '.tlabel{{fill:{temperature:}}}'
+                '.plabel{{fill:{precipitation:}}}'
+                '.temp{{fill:none;stroke:{temperature:};stroke-width:4}}'
+                '.bar{{fill:none;stroke:{precipitation:};stroke-width:3}}'
+                '.range{{stroke:{precipitation:};stroke-width:1;fill:{precipitation:};fill-opacity:0.5}}'
+                '.min{{stroke:{precipitation:};stroke-width:1;fill:{precipitation:}}}'
+                '.wind{{stroke:{wind:};stroke-width:3;fill:{wind:}}}'
+                '.calm{{fill:none;stroke-width:2}}'
+                '.place{{fill:{placename:};font-size:40px}}'
+                '.now{{fill:{temperature:};font-size:55px}}'
+                '</style>').format(**vars(self.colors))
+
     def render_background(self):
-        return '    <path d="M {left:} {top:} L {right:} {top:} L {right:} {bottom:} L {left:} {bottom:} Z" style="fill:{color:}"/>'.format(
-            top=0,
-            left=0,
-            right=self.width,
-            bottom=self.height,
-            color=self.colors.background)
-
-    def render_grid(self, time: datetime):
-        grid = ''
-        grid += '    <path d="M {left:} {top:} L {right:} {top:} L {right:} {bottom:} L {left:} {bottom:} Z" style="fill:none;stroke:{color:};stroke-width:1"/>\n'.format(
-            left=self.left_margin,
-            top=self.top_margin,
-            right=self.width - self.right_margin,
-            bottom=self.height - self.bottom_margin,
-            color=self.colors.grid)
-        for prediction in self.predictions.sequence:
-            time = prediction.timestamp.astimezone()
-            break
-        for h in range(12):
-            x=self.h2x(h)
-            grid+='    <text x="{x:}" y="{top:}" fill="{color:}">{h:}</text>\n'.format(
-                x=x-10,
-                top=self.top_margin-5,
-                h=datetime.strftime(time + timedelta(hours=h), "%H"),
-                color=self.colors.hour)
-
-            if h > 0 and h < 11:
-                grid+='    <line x1="{x:}" y1="{top:}" x2="{x:}" y2="{bottom:}" style="stroke:{color:};stroke-width:1"/>\n'.format(
-                    x=x,
-                    top=self.top_margin,
-                    bottom=self.height-self.bottom_margin,
-                    color=self.colors.grid)
+        return '<rect width="{}" height="{}" fill="{}"/>'.format(self.width, self.height, self.colors.background)
 
-        for t in range(self.min_temp, self.max_temp):
-            y = self.temp2y(t)
-            grid+='    <line x1="{left:}" y1="{y:}" x2="{right:}" y2="{y:}" style="stroke:{color:};stroke-width:1"/>\n'.format(
-                y=y,
-                left=self.left_margin,
-                right=self.width-self.right_margin,
-                color=self.colors.grid)
+    def render_chrome(self):
+        return self.render_background() + '<text x="350" y="55" class="place">{}</text>'.format(escape(self.place))
 
-            grid+='    <text x="2" y="{y:}" fill="{color:}">{text:}°</text>\n'.format(
+    def render_hours(self, time: datetime):
+        y = self.n(self.top_margin-5)
+        return ''.join(
+            '<text x="{x:}" y="{y:}">{h:}</text>'.format(
+                x=self.n(x),
                 y=y,
-                text=t,
-                color=self.colors.temperature)
-
-        for y in range(self.temp_range):
-            mm=round(y/self.rain_multiplier)
-            grid+='    <text x="{x:}" y="{y:}" fill="{color:}">{text:}mm</text>\n'.format(
-                y=self.rain2y(mm),
-                x=self.width - self.right_margin + 3,
-                text=mm,
-                color=self.colors.precipitation)
+                h=label)
+            for x, label in zip(self.layout.hour_x, self.layout.hour_labels))
 
-        return grid
+    def render_grid(self):
+        layout = self.layout
+        left = self.n(self.left_margin)
+        right = self.n(self.width - self.right_margin)
+        top = self.n(self.top_margin)
+        bottom = self.n(self.height - self.bottom_margin)
+        grid = ['<path d="M{left:} {top:}H{right:}V{bottom:}H{left:}Z" class="frame"/>'.format(
+            left=left, top=top, right=right, bottom=bottom)]
+        lines = ['M{x:} {top:}V{bottom:}'.format(x=self.n(x), top=top, bottom=bottom) for x in layout.grid_x]
+        labels = []
+        for t, y in zip(layout.temp_ticks, layout.temp_tick_y):
+            y = self.n(y)
+            lines.append('M{left:} {y:}H{right:}'.format(left=left, y=y, right=right))
+            labels.append('<text x="2" y="{y:}" class="tlabel">{text:}°</text>'.format(y=y, text=t))
+        grid.append('<path d="{}" class="grid"/>'.format(''.join(lines)))
+        grid.extend(labels)
+        x = self.n(self.width - self.right_margin + 3)
+        for mm, y in zip(layout.rain_ticks, layout.rain_tick_y):
+            grid.append('<text x="{x:}" y="{y:}" class="plabel">{text:}mm</text>'.format(
+                y=self.n(y),
+                x=x,
+                text=mm))
+        return ''.join(grid)
 
     def render_precipitation(self):
-        graph=''
-        h=0
-        prev_precipitation_expected = 0
-        prev_precipitation_min = 0
-        for prediction in self.predictions.sequence:
-            temp = prediction.data['air_temperature']
-            y=self.temp2y(temp)
-            precipitation_min = prediction.data['precipitation_amount_min']
-            precipitation_expected = prediction.data['precipitation_amount']
-            precipitation_max = prediction.data['precipitation_amount_max']
-            if (precipitation_max > 0 or prev_precipitation_expected > 0) and h > 0:
-                graph+= '    <path d="M {left:} {top:} L {right:} {top:} M {x:} {top:} L {x:} {bottom:} M {left:} {bottom:} L {right:} {bottom:} M {left:} {y:} L {right:} {y:}" style="stroke:{color:};stroke-width:3"/>\n'.format(
-                    left=self.h2x(h) - 3,
-                    right=self.h2x(h) + 3,
-                    x=self.h2x(h),
-                    top=self.rain2y(precipitation_max),
-                    bottom=self.rain2y(precipitation_min),
-                    y=self.rain2y(precipitation_expected),
-                    color=self.colors.precipitation)
-                if prev_precipitation_expected > 0 or precipitation_expected > 0:
-                    graph+= '    <path d="M {prev_x:} {prev_ymin:} L {prev_x:} {prev_y:} L {x:} {y:} L {x:} {ymin} Z" style="stroke:{color:};stroke-width:1;fill:{color:};fill-opacity:0.5"/>\n'.format(
-                        prev_x=self.h2x(h - 1),
-                        prev_ymin=self.rain2y(prev_precipitation_min),
-                        prev_y=self.rain2y(prev_precipitation_expected),
-                        x=self.h2x(h),
-                        y=self.rain2y(precipitation_expected),
-                        ymin=self.rain2y(precipitation_min),
-                        color=self.colors.precipitation
-                    )
-                if prev_precipitation_min > 0 or precipitation_min > 0:
-                    graph+= '    <path d="M {prev_x:} {ymin:} L {prev_x:} {prev_y:} L {x:} {y:} L {x:} {ymin:} Z" style="stroke:{color:};stroke-width:1;fill:{color:}"/>\n'.format(
-                        ymin=self.rain2y(0),
-                        prev_x=self.h2x(h-1),
-                        prev_y=self.rain2y(prev_precipitation_min),
-                        x=self.h2x(h),
-                        y=self.rain2y(precipitation_min),
-                        color=self.colors.precipitation
-                    )
-            prev_precipitation_min = precipitation_min
-            prev_precipitation_expected = precipitation_expected
-            h += 1
-        return graph
-
-    def render_temperature(self):
-        graph = ''
-        h=0
-        for prediction in self.predictions.sequence:
-            temp = prediction.data['air_temperature']
-            y = self.temp2y(temp)
-            if h > 0:
-                graph+= '    <line x1="{prevx:}" y1="{prevy:}" x2="{x:}" y2="{y:}" style="stroke:{color:};stroke-width:4"/>\n'.format(
-                    prevx=self.h2x(h-1),
-                    prevy=prev_y,
-                    x=self.h2x(h),
+        layout = self.layout
+        bars = []
+        areas = []
+        for h in layout.bars:
+            x = self.n(layout.x[h])
+            prev_x = self.n(layout.x[h - 1])
+            bottom = self.n(layout.rain_bottom[h])
+            y = self.n(layout.rain_y[h])
+            bars.append('M{left:} {top:}H{right:}M{x:} {top:}V{bottom:}M{left:} {bottom:}H{right:}M{left:} {y:}H{right:}'.format(
+                left=self.n(layout.x[h] - 3),
+                right=self.n(layout.x[h] + 3),
+                x=x,
+                top=self.n(layout.rain_top[h]),
+                bottom=bottom,
+                y=y))
+            if layout.ranges[h]:
+                areas.append('<path d="M{prev_x:} {prev_ymin:}V{prev_y:}L{x:} {y:}V{ymin:}Z" class="range"/>'.format(
+                    prev_x=prev_x,
+                    prev_ymin=self.n(layout.rain_bottom[h - 1]),
+                    prev_y=self.n(layout.rain_y[h - 1]),
+                    x=x,
                     y=y,
-                    color=self.colors.temperature)
-            prev_y = y
-            h += 1
+                    ymin=bottom))
+            if layout.mins[h]:
+                areas.append('<path d="M{prev_x:} {ymin:}V{prev_y:}L{x:} {y:}V{ymin:}Z" class="min"/>'.format(
+                    ymin=self.n(layout.rain_zero),
+                    prev_x=prev_x,
+                    prev_y=self.n(layout.rain_bottom[h - 1]),
+                    x=x,
+                    y=bottom))
+        if bars:
+            areas.append('<path d="{}" class="bar"/>'.format(''.join(bars)))
+        return ''.join(areas)
 
-        return graph
+    def render_temperature(self):
+        points = ['{} {}'.format(self.n(x), self.n(y)) for x, y in zip(self.layout.x, self.layout.temp_y)]
+        if len(points) < 2:
+            return ''
+        return '<polyline points="{}" class="temp"/>'.format(' '.join(points))
 
     def render_sky_icons(self):
-        icons = ''
-        h=0
-        for prediction in self.predictions.sequence:
-            y = self.temp2y(prediction.data['air_temperature'])
-            icony = y - 1.5*self.hour_width if y > self.height/2 else y + self.hour_width
-            icons+= '    <image width="{size:}" height="{size:}" x="{x:}" y="{y:}" href="{ref:}"/>\n'.format(
-                x=self.h2x(h)-self.hour_width/2,
-                y=icony,
-                size=self.hour_width,
-                ref=self.get_icon(prediction.data['symbol_code']))
-            h += 1
-        return icons
+        layout = self.layout
+        size = self.n(layout.icon_size)
+        return ''.join(
+            '<image width="{size:}" height="{size:}" x="{x:}" y="{y:}" href="{ref:}"/>'.format(
+                x=self.n(x),
+                y=self.n(y),
+                size=size,
+                ref=self.get_icon(symbol, layout.icon_size))
+            for x, y, symbol in zip(layout.icon_x, layout.icon_y, layout.symbols))
 
     def render_wind(self):
-        icons = ''
-        h=0
-        for prediction in self.predictions.sequence:
-            icons +='    {}\n'.format(windbarb(
-                prediction.data['wind_speed_percentile_90'],
-                prediction.data['wind_from_direction'],
-                self.h2x(h) - 2,
-                self.height - self.bottom_margin + 14,
-                scale=0.4,
-                color=self.colors.wind
-            ))
-            h+= 1
-        return icons
+        layout = self.layout
+        return ''.join(
+            self.barbs.use(speed, direction, x, layout.wind_y, self.barb_scale, 'wind')
+            for x, speed, direction in zip(layout.wind_x, layout.wind_speed, layout.wind_direction))
 
     def render_header(self):
-        header = ''
-        header+='    <image height="60" width="60" x="5" y="5" href="{ref:}"/>\n'.format(
-            ref=self.get_icon(self.predictions.current.data['symbol_code']))
-        header+='    <text x="70" y="55" fill="{color:}" font-size="55">{}°C</text>\n'.format(
-            self.predictions.current.data['air_temperature'],
-            color=self.colors.temperature)
-        header+='    {}\n'.format(windbarb(
-            self.predictions.current.data['wind_speed_percentile_90'],
-            self.predictions.current.data['wind_from_direction'],
-            300, 35, 0.8, color=self.colors.wind))
-        header+= '    <text x="350" y="55" fill="{color:}" font-size="40">{place:}</text>\n'.format(
-            color=self.colors.placename,
-            place=self.place)
-        return header
+        current = self.predictions.current.data
+        return ''.join([
+            '<image height="60" width="60" x="5" y="5" href="{ref:}"/>'.format(
+                ref=self.get_icon(current['symbol_code'], 60)),
+            '<text x="70" y="55" class="now">{}°C</text>'.format(self.n(current['air_temperature'])),
+            self.barbs.use(current['wind_speed_percentile_90'], current['wind_from_direction'], 300, 35, 0.8, 'wind')
+        ])
+
+    def layer(self, name, key, renders):
+        cached = self.layer_cache.get(name)
+        if cached is None or cached[0] != key:
+            cached = self.layer_cache[name] = (key, ''.join(render() for render in renders))
+        return cached[1]
+
+    def make_layout(self, now: datetime, key = None):
+        graph = (self.left_margin, self.height - self.bottom_margin, self.graph_width, self.graph_height)
+        limits = (self.min_temp, self.max_temp, self.rain_multiplier)
+        return window_layout(self.predictions.sequence, now, graph, self.columns, self.step, limits, self.height, key)
+
+    def get_layout(self, now: datetime):
+        sequence = self.predictions.sequence
+        key = (sequence, (self.min_temp, self.max_temp, self.rain_multiplier), now.astimezone().utcoffset())
+        if len(sequence) == 0:
+            key += (now,)
+        if self.layout is None or self.layout.key != key:
+            self.layout = self.make_layout(now, key)
+        return self.layout
+
+    def header_key(self):
+        current = self.predictions.current
+        return (self.predictions.sequence.forecast, current.timestamp if current else None)
+
+    def render_layers(self, now: datetime):
+        self.get_layout(now)
+        limits = (self.min_temp, self.max_temp, self.rain_multiplier)
+        window = (self.predictions.sequence, limits)
+        return [
+            self.layer('chrome', None, [self.render_chrome]),
+            self.layer('curves', window, [self.render_precipitation, self.render_temperature]),
+            self.layer('grid', limits, [self.render_grid]),
+            self.layer('overlay', self.layout.key, [lambda: self.render_hours(now), self.render_sky_icons, self.render_wind]),
+            self.layer('header', self.header_key(), [self.render_header])
+        ]
+
+    def window(self, forecast: wx_data, now: datetime):
+        if self.step == 1 and forecast.hourly() - bisect_left(forecast.timestamps, now.timestamp()) >= self.columns:
+            return forecast.window(now, self.columns)
+        import series
+        return series.window(forecast, now, self.columns*self.step, self.step)
 
     def render_svg(self, forecast: wx_data, now: datetime):
-        self._get_limits(forecast.predictions(now))
-        image ='  <svg height="{}" width="{}" xmlns="http://www.w3.org/2000/svg">\n'.format(self.height, self.width)
-        image += self.render_background()
-        image += self.render_precipitation()
-        image += self.render_temperature()
-        image += self.render_grid(now)
-        image += self.render_sky_icons()
-        image += self.render_wind()
-        image += self.render_header()
-        image+='  </svg>\n'
-        return image
+        self._get_limits(self.window(forecast, now))
+        layers = self.render_layers(now)
+        return '\n'.join([
+            '<svg height="{}" width="{}" xmlns="http://www.w3.org/2000/svg">'.format(self.height, self.width),
+            self.style,
+            self.barbs.render(),
+            *layers,
+            '</svg>\n'])
+
+    def render_image(self, forecast: wx_data, now: datetime):
+        from cairosvg import svg2png
+        from PIL import Image
+        svg_image = self.render_svg(forecast, now)
+        with metrics.span('rasterize'):
+            png_image = Image.open(io.BytesIO(svg2png(svg_image, unsafe=True,output_width=600, output_height=448)))
+        return png_image.resize((self.width, self.height))
+
+
+class Test_svg(unittest.TestCase):
+    def test_barb_sheet(self):
+        svg = barb_sheet()
+        root = ElementTree.fromstring(svg)
+        ns = '{http://www.w3.org/2000/svg}'
+        ids = [path.get('id') for path in root.iter(ns + 'path')]
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertEqual(len(ids), len(set(barb_counts(kts) for kts in range(3, 110))))
+        self.assertEqual(len(list(root.iter(ns + 'use'))), 107)
+        self.assertEqual(len(list(root.iter(ns + 'circle'))), 3)
 
+    def test_barb_shapes(self):
+        self.assertEqual(barb_counts(65), (1, 1, 1))
+        self.assertEqual(barb_path((0, 1, 1)), 'M-5 27 L0 32 L5 27 M0 32 L0 -32 M0 -27 L20 -32 M0 -18 L10 -21')
+
+    def test_missing_values(self):
+        start = datetime(2024, 6, 25, 0, 0, 0, 0, pytz.utc)
+        timeseries = wx_data._chart_timeseries(14, temp=lambda h: 12 + h % 3, wind=lambda h: 1, rain=lambda h: 0, rain_max=lambda h: 1)
+        del timeseries[3]['data']['instant']['details']['air_temperature']
+        del timeseries[5]['data']['next_1_hours']['details']['precipitation_amount_max']
+        forecast = wx_data.wx({'properties': {'timeseries': timeseries}}, {'expires': 'Tue, 25 Jun 2024 05:22:48 GMT'})
+        r = renderer((600, 448), 'Test', colors({}))
+        now = start + timedelta(minutes=30)
+        r._get_limits(r.window(forecast, now))
+        self.assertEqual((r.min_temp, r.max_temp, r.rain_multiplier), (12, 14, 2))
+        self.assertIn('>12°C<', r.render_svg(forecast, now))
+        later = start + timedelta(hours=3, minutes=10)
+        r.render_svg(forecast, later)
+        header = r.layer_cache['header']
+        r.render_svg(forecast, later + timedelta(minutes=20))
+        self.assertIs(r.layer_cache['header'], header)
+        for entry in timeseries[1:]:
+            entry['data']['instant']['details'].pop('air_temperature', None)
+        r._get_limits(r.window(wx_data.wx({'properties': {'timeseries': timeseries}}, {'expires': 'Tue, 25 Jun 2024 05:22:48 GMT'}), now))
+        self.assertEqual((r.min_temp, r.max_temp), (10000, -10000))
 
 if __name__ == '__main__':
-    img='<svg height="448" width="600" xmlns="http://www.w3.org/2000/svg">\n'
-    for kts in range(110):
-        x = (kts % 20) * 30 + 10
-        y = math.floor(kts / 20)*4*20+10
-        img+='<text x="{x:}" y="{y:}">{msg:}</text>\n'.format(x=x,y=y,msg=kts)
-        img+=windbarb(kts*1852/3600, 0, x,y+30, 0.7, color='black')
-    img+='</svg>\n'
     f = open('barbs.svg','w')
-    f.write(img)
+    f.write(barb_sheet())
     f.close()
@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+
+import argparse
+import asyncio
+import gc
+import json
+import os
+import selectors
+import sys
+import syslog
+import tempfile
+import time
+import unittest
+from datetime import datetime, timedelta
+from urllib.parse import parse_qs, urlparse
+import pytz
+
+import fetch
+import fixtures
+import metrics
+from scheduler import displays_config, location, location_key, read_config, scheduler
+from wx_data import parse_header_timestamp
+
+HTTP_DATE = '%a, %d %b %Y %H:%M:%S GMT'
+SAMPLED = ['fetch', 'parse', 'render', 'quantize', 'show']
+DEFAULT_CONFIG = {'lat': 59.91, 'long': 10.75, 'placename': 'Replay'}
+
+def http_date(time):
+    return time.astimezone(pytz.UTC).strftime(HTTP_DATE)
+
+class virtual_clock:
+    def __init__(self, start):
+        self.start = start
+        self.time = 0.0
+        self.pending = 0
+
+class virtual_selector(selectors.DefaultSelector):
+    def __init__(self, clock):
+        super().__init__()
+        self.clock = clock
+
+    def select(self, timeout = None):
+        if timeout is not None and timeout <= 0:
+            return super().select(0)
+        if self.clock.pending:
+            return super().select(None)
+        events = super().select(0)
+        if events or timeout is None:
+            return events or super().select(None)
+        self.clock.time += timeout
+        return []
+
+class virtual_loop(asyncio.SelectorEventLoop):
+    def __init__(self, start):
+        self.clock = virtual_clock(start)
+        super().__init__(virtual_selector(self.clock))
+
+    def time(self):
+        return self.clock.time
+
+    def now(self):
+        return self.clock.start + timedelta(seconds=self.clock.time)
+
+    def run_in_executor(self, executor, function, *args):
+        future = super().run_in_executor(executor, function, *args)
+        self.clock.pending += 1
+        future.add_done_callback(self._executor_done)
+        return future
+
+    def _executor_done(self, future):
+        self.clock.pending -= 1
+
+class recorded_responses:
+    def __init__(self, directory):
+        self.responses = {}
+        for name in sorted(os.listdir(directory)):
+            lat, long = name.split(',')
+            path = os.path.join(directory, name)
+            stamps = sorted(f[:-len('.json')] for f in os.listdir(path) if f.endswith('.json'))
+            self.responses[location_key(float(lat), float(long))] = [
+                (datetime.strptime(stamp, '%Y%m%dT%H%M%S').replace(tzinfo=pytz.UTC), os.path.join(path, stamp))
+                for stamp in stamps]
+        if not self.responses:
+            raise ValueError("No recorded responses in {}".format(directory))
+
+    def start(self):
+        return min(responses[0][0] for responses in self.responses.values())
+
+    def response(self, key, endpoint, now):
+        if key not in self.responses:
+            raise KeyError("No recorded responses for lat={}, long={}".format(*key))
+        responses = self.responses[key]
+        index = max(0, sum(1 for issued, _ in responses if issued <= now) - 1)
+        issued, name = responses[index]
+        with open(name + '.json', 'rb') as f:
+            body = f.read()
+        with open(name + '.headers') as f:
+            headers = json.load(f)
+        following = responses[index + 1][0] if index + 1 < len(responses) else None
+        return body, headers, following
+
+class synthetic_responses:
+    def __init__(self, scenario):
+        self.scenario = scenario
+
+    def start(self):
+        return fixtures.START
+
+    def response(self, key, endpoint, now):
+        issued = now.replace(minute=0, second=0, microsecond=0)
+        headers = {'expires': http_date(issued + timedelta(minutes=30)), 'last-modified': http_date(issued)}
+        return fixtures.forecast_bytes(self.scenario, endpoint, issued), headers, issued + timedelta(hours=1)
+
+class replay_response:
+    def __init__(self, status, headers, body = b''):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def stream(self, size):
+        for start in range(0, len(self.body), size):
+            yield self.body[start:start + size]
+
+    def release_conn(self):
+        pass
+
+class replay_http:
+    def __init__(self, responses, now):
+        self.responses = responses
+        self.now = now
+
+    def request(self, method, url, headers, preload_content = True):
+        query = parse_qs(urlparse(url).query)
+        key = location_key(float(query['lat'][0]), float(query['lon'][0]))
+        endpoint = 'compact' if '/compact?' in url else 'complete'
+        now = self.now()
+        body, recorded, following = self.responses.response(key, endpoint, now)
+        if 'last-modified' in recorded and headers.get('If-Modified-Since') == recorded['last-modified']:
+            expires = following if following and following > now else now + timedelta(hours=1)
+            return replay_response(304, {'expires': http_date(expires)})
+        return replay_response(200, recorded, body)
+
+class replay_scheduler(scheduler):
+    def __init__(self, config_file, responses, loop):
+        super().__init__(config_file)
+        self.loop = loop
+        self.http = replay_http(responses, self.now)
+
+    def now(self):
+        return self.loop.now()
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction*len(ordered)))]
+
+def counter(name):
+    return sum(value for (counter, _), value in metrics.default.counters.items() if counter == name)
+
+def sample_bytes():
+    return sum(sys.getsizeof(samples) + len(samples)*sys.getsizeof(0.0) for samples in metrics.default.samples.values())
+
+async def replay(sched, days):
+    task = asyncio.ensure_future(sched.run())
+    start = time.perf_counter()
+    memory = []
+    try:
+        for day in range(days):
+            await asyncio.sleep(24*3600)
+            if task.done():
+                task.result()
+            gc.collect()
+            memory.append((day + 1, metrics.rss_bytes() - sample_bytes(), len(gc.get_objects()), time.perf_counter() - start))
+            metrics.event('replay', day=day + 1, rss=memory[-1][1], objects=memory[-1][2])
+    finally:
+        for t in [task] + sched.tasks:
+            t.cancel()
+        await asyncio.gather(task, *sched.tasks, return_exceptions=True)
+    return time.perf_counter() - start, memory
+
+def replay_config(config, directory, sink, output):
+    displays = []
+    for entry in displays_config(config):
+        entry = {**entry, 'type': sink}
+        if sink == 'file':
+            entry['path'] = os.path.join(output, '{}.png'.format(entry['name']))
+        displays.append(entry)
+    config = {key: value for key, value in config.items() if key not in ('metrics_port', 'metrics_textfile', 'record_dir')}
+    return {'user_agent': 'replay', **config, 'cache_dir': directory, 'prerender_hours': 0, 'displays': displays}
+
+def run_replay(config, responses, days, sink = 'null', output = '.'):
+    metrics.default.reset()
+    metrics.default.keep_samples(*SAMPLED)
+    with tempfile.TemporaryDirectory() as directory:
+        config_file = os.path.join(directory, 'config.json')
+        with open(config_file, 'w') as f:
+            json.dump(replay_config(config, directory, sink, output), f)
+        loop = virtual_loop(responses.start())
+        try:
+            sched = replay_scheduler(config_file, responses, loop)
+            elapsed, memory = loop.run_until_complete(replay(sched, days))
+            loop.run_until_complete(loop.shutdown_default_executor())
+        finally:
+            loop.close()
+        if sched.history:
+            sched.history.close()
+    return {
+        'days': days,
+        'seconds': elapsed,
+        'frames': counter('frames'),
+        'shown': counter('display_refresh'),
+        'skipped': counter('display_skipped'),
+        'fetches': counter('fetch'),
+        'latency': {name: samples for name, samples in metrics.default.samples.items() if samples},
+        'memory': memory
+    }
+
+def report(result, out = sys.stdout):
+    out.write('{} simulated days in {:.1f} s, {} frames ({} shown, {} skipped), {} fetches\n'.format(
+        result['days'], result['seconds'], result['frames'], result['shown'], result['skipped'], result['fetches']))
+    out.write('{:.2f} frames/s, {:.1f} simulated hours/s\n'.format(
+        result['frames']/result['seconds'], result['days']*24/result['seconds']))
+    out.write('{:<10} {:>8} {:>10} {:>10} {:>10} {:>10}\n'.format('stage', 'count', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms'))
+    for name, samples in result['latency'].items():
+        out.write('{:<10} {:>8} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.2f}\n'.format(
+            name, len(samples), *(1000*percentile(samples, q) for q in (0.5, 0.9, 0.99)), 1000*max(samples)))
+    out.write('{:<10} {:>12} {:>12} {:>10}\n'.format('day', 'rss KiB', 'objects', 'seconds'))
+    for day, rss, objects, seconds in result['memory']:
+        out.write('{:<10} {:>12} {:>12} {:>10.1f}\n'.format(day, rss//1024, objects, seconds))
+    if len(result['memory']) > 1:
+        first, last = result['memory'][0], result['memory'][-1]
+        out.write('growth after day {}: {:.1f} KiB/day, {:.0f} objects/day\n'.format(
+            first[0], (last[1] - first[1])/1024/(last[0] - first[0]), (last[2] - first[2])/(last[0] - first[0])))
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", type=str, help="configuration with the locations and displays to replay (defaults to one location)")
+    parser.add_argument("--recordings", type=str, help="directory of responses saved with record_dir (defaults to generated forecasts)")
+    parser.add_argument("--scenario", choices=list(fixtures.SCENARIOS), default='calm', help="generated forecast to replay (defaults to calm)")
+    parser.add_argument("--days", type=int, default=30, help="number of days to simulate (defaults to 30)")
+    parser.add_argument("--sink", choices=['null', 'file'], default='null', help="where frames go (defaults to null)")
+    parser.add_argument("--output", type=str, default='.', help="directory for the frames of a file sink (defaults to .)")
+    args = parser.parse_args()
+
+    syslog.openlog()
+    syslog.setlogmask(syslog.LOG_MASK(syslog.LOG_WARNING))
+    config = read_config(args.config) if args.config else DEFAULT_CONFIG
+    responses = recorded_responses(args.recordings) if args.recordings else synthetic_responses(args.scenario)
+    report(run_replay(config, responses, args.days, args.sink, args.output))
+    return 0
+
+class Test_replay(unittest.TestCase):
+    def test_virtual_clock_does_not_sleep(self):
+        loop = virtual_loop(fixtures.START)
+        async def wait():
+            await asyncio.sleep(3600)
+            return await loop.run_in_executor(None, loop.now)
+        try:
+            start = time.perf_counter()
+            self.assertEqual(loop.run_until_complete(wait()), fixtures.START + timedelta(hours=1))
+            self.assertLess(time.perf_counter() - start, 1)
+        finally:
+            loop.close()
+
+    def test_not_modified_until_the_next_forecast(self):
+        now = fixtures.START + timedelta(minutes=40)
+        http = replay_http(synthetic_responses('calm'), lambda: now)
+        first = http.request('GET', 'https://example/compact?lat=59.91&lon=10.75', {})
+        self.assertEqual(first.status, 200)
+        again = http.request('GET', 'https://example/compact?lat=59.91&lon=10.75', {'If-Modified-Since': first.headers['last-modified']})
+        self.assertEqual(again.status, 304)
+        self.assertEqual(parse_header_timestamp(again.headers['expires']), fixtures.START + timedelta(hours=1))
+
+    def test_recorded_responses(self):
+        with tempfile.TemporaryDirectory() as directory:
+            sched = scheduler(None)
+            sched.record_dir = os.path.join(directory, 'recordings')
+            loc = location(location_key(59.91, 10.75), 'url', fetch.forecast_cache(os.path.join(directory, 'cache')))
+            for hour in range(2):
+                issued = fixtures.START + timedelta(hours=hour)
+                sched.now = lambda: issued
+                loc.cache.store('url', [b'{"hour": ', str(hour).encode(), b'}'], {'last-modified': http_date(issued)})
+                sched.record_response(loc)
+            responses = recorded_responses(sched.record_dir)
+            self.assertEqual(responses.start(), fixtures.START)
+            body, headers, following = responses.response(loc.key, 'complete', fixtures.START + timedelta(minutes=30))
+            self.assertEqual((body, headers, following), (b'{"hour": 0}', {'last-modified': http_date(fixtures.START)}, issued))
+            self.assertEqual(responses.response(loc.key, 'complete', issued + timedelta(days=1))[0], b'{"hour": 1}')
+
+    def test_replay_two_days(self):
+        result = run_replay(DEFAULT_CONFIG, synthetic_responses('calm'), 2)
+        self.assertEqual(len(result['memory']), 2)
+        self.assertGreaterEqual(result['frames'], 48)
+        self.assertGreaterEqual(result['fetches'], 48)
+        again = run_replay(DEFAULT_CONFIG, synthetic_responses('calm'), 1)
+        self.assertLess(again['frames'], result['frames'])
+        self.assertLess(len(again['latency']['render']), len(result['latency']['render']))
+
+if __name__ == '__main__':
+    sys.exit(run())
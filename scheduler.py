@@ -0,0 +1,636 @@
+#!/usr/bin/env python
+
+import asyncio
+import json
+import os
+import random
+import shutil
+import signal
+import subprocess
+import sys
+import syslog
+import tempfile
+import threading
+import time
+import traceback
+import unittest
+from datetime import datetime, timedelta
+import pytz
+
+import fetch
+import metrics
+import render_svg
+from colors import colors
+from wx_data import wx
+
+def str2loglevel(name: str):
+    if name == 'WARNING':
+        return syslog.LOG_WARNING
+    if name == 'ERROR':
+        return syslog.LOG_ERR
+    if name == 'CRITICAL':
+        return syslog.LOG_CRIT
+    if name == 'INFO':
+        return syslog.LOG_INFO
+    if name == 'DEBUG':
+        return syslog.LOG_DEBUG
+
+def read_config(name):
+    config_file = name if name else './config.json'
+    with open(config_file) as config:
+        conf = json.load(config)
+        return conf
+
+def load_forecast(cache, url, fields, now, hours):
+    headers = cache.headers(url)
+    if headers is None:
+        return None
+    return wx.from_stream(cache.chunks(), headers, fields, now, hours)
+
+def log_exception(message, e):
+    syslog.syslog(syslog.LOG_ERR, "{} {}".format(message, e))
+    for line in traceback.format_exception(e):
+        syslog.syslog(syslog.LOG_ERR, line)
+
+def backoff(attempt, base, limit):
+    return min(limit, base * 2 ** attempt) * random.uniform(0.5, 1.5)
+
+def location_key(lat, long):
+    return (round(lat, 4), round(long, 4))
+
+def locations_config(config):
+    if 'locations' in config:
+        return config['locations']
+    return [{'name': 'default', 'lat': config['lat'], 'long': config['long'], 'placename': config['placename']}]
+
+def displays_config(config):
+    if 'displays' in config:
+        return config['displays']
+    return [{'name': 'default', 'location': locations_config(config)[0]['name']}]
+
+class location:
+    def __init__(self, key, url, cache):
+        self.key = key
+        self.url = url
+        self.cache = cache
+        self.fields = None
+        self.hours = 0
+        self.visible_hours = 0
+        self.outputs = []
+        self.forecast = None
+        self.last_fetch = None
+        self.wake = asyncio.Event()
+
+    def describe(self):
+        return "lat={}, long={}".format(*self.key)
+
+class output:
+    def __init__(self, name, entry, visible_hours, prerender_hours):
+        self.name = name
+        self.entry = entry
+        self.visible_hours = visible_hours
+        self.prerender_hours = prerender_hours
+        self.fields = render_svg.renderer.fields
+        self.hours = visible_hours + prerender_hours
+        self.device = None
+        self.spec = None
+        self.color_settings = None
+        self.frames = None
+        self.renderer = None
+        self.location = None
+        self.render_queue = asyncio.Queue()
+        self.display_queue = asyncio.Queue(maxsize=1)
+
+class scheduler:
+    def __init__(self, config_file, open_display = None):
+        self.config_file = config_file
+        self.open_display = open_display
+        self.http = None
+        self.http_lock = threading.Lock()
+        self.loglevel = syslog.LOG_INFO
+        self.user_agent = None
+        self.devices = {}
+        self.device_locks = {}
+        self.frames = {}
+        self.locations = {}
+        self.outputs = []
+        self.prerenderer = None
+        self.tasks = []
+        self.metrics_textfile = None
+        self.metrics_server = None
+        self.history = None
+        self.history_lock = threading.Lock()
+        self.record_dir = None
+        self.config_retry = 20
+        self.config_wake = None
+        metrics.default.gauge_function('forecast_age_seconds', self.forecast_ages)
+
+    def now(self):
+        return datetime.now(tz=pytz.UTC)
+
+    def forecast_ages(self):
+        now = self.now()
+        ages = {}
+        for loc in self.locations.values():
+            issued = loc.forecast.issued if loc.forecast and loc.forecast.issued else loc.last_fetch
+            if issued:
+                ages[(('location', '{},{}'.format(*loc.key)),)] = (now - issued).total_seconds()
+        return ages
+
+    def export_metrics(self):
+        if self.metrics_textfile:
+            try:
+                metrics.default.write_textfile(self.metrics_textfile)
+            except OSError as e:
+                syslog.syslog(syslog.LOG_ERR, "Failed to write metrics, err={}".format(e))
+
+    def pool(self):
+        with self.http_lock:
+            if self.http is None:
+                import urllib3
+                self.http = urllib3.PoolManager(timeout=urllib3.Timeout(connect=10, read=30), retries=False)
+            return self.http
+
+    def record_history(self, loc):
+        if self.history_records <= 0:
+            return
+        from history import FIELDS, forecast_history
+        forecast = load_forecast(loc.cache, loc.url, FIELDS, None, None)
+        if forecast is None:
+            return
+        with self.history_lock:
+            if self.history is None or self.history.path != self.history_file:
+                if self.history:
+                    self.history.close()
+                self.history = forecast_history(self.history_file, self.history_records)
+            self.history.append(forecast, *loc.key)
+
+    def record_response(self, loc):
+        directory = os.path.join(self.record_dir, '{},{}'.format(*loc.key))
+        name = os.path.join(directory, self.now().strftime('%Y%m%dT%H%M%S'))
+        os.makedirs(directory, exist_ok=True)
+        shutil.copyfile(loc.cache.body_file, name + '.json')
+        with open(name + '.headers', 'w') as f:
+            json.dump(loc.cache.headers(loc.url), f)
+
+    def device(self, entry):
+        if self.open_display is None:
+            import sinks
+            self.open_display = sinks.open_sink
+        name = entry['name']
+        settings = {key: entry.get(key) for key in ('type', 'path', 'format', 'resolution')}
+        if name not in self.devices or self.devices[name][0] != settings:
+            self.devices[name] = (settings, self.open_display(entry))
+            self.device_locks.setdefault(name, threading.Lock())
+        return self.devices[name][1]
+
+    def prepare_output(self, out, config, cache_dir):
+        import prerender
+        from frame_diff import frame_diff
+        entry = out.entry
+        def setting(key, default):
+            return entry.get(key, config.get(key, default))
+        out.device = self.device(entry)
+        out.spec = prerender.RendererSpec(
+            backend=setting('renderer', 'raster'),
+            resolution=out.device.resolution,
+            place=entry['placename'],
+            colors=setting('colors', {}),
+            icon_dir=os.path.join(os.getcwd(), 'weather', 'svg'),
+            icon_store=config.get('icon_cache', os.path.join(cache_dir, 'icons')),
+            dithering={'chart': 'nearest', 'icons': 'diffusion', **setting('dithering', {})},
+            precision=setting('svg_precision', 1),
+            hours=setting('hours', render_svg.renderer.hours))
+        out.color_settings = colors(out.spec.colors)
+        out.renderer = prerender.make_renderer(out.spec)
+        frame_state = os.path.join(cache_dir, 'displays', entry['name'], 'last_frame')
+        if frame_state not in self.frames:
+            self.frames[frame_state] = frame_diff(frame_state)
+        out.frames = self.frames[frame_state]
+
+    def prepare(self, outputs):
+        for out in outputs:
+            try:
+                self.prepare_output(out, self.config, self.cache_dir)
+            except Exception as e:
+                log_exception("Failed to set up display {}".format(out.name), e)
+
+    def prepare_prerenderer(self, outputs):
+        import prerender
+        workers = self.config.get('prerender_workers', 1)
+        prerendered = [(out.location.key, out.spec) for out in outputs if out.renderer and out.prerender_hours > 0]
+        if self.prerenderer and (not prerendered or self.prerenderer.workers != workers):
+            self.prerenderer.shutdown()
+            self.prerenderer = None
+        if prerendered and self.prerenderer is None:
+            self.prerenderer = prerender.prerenderer(workers)
+        if self.prerenderer:
+            self.prerenderer.retain(prerendered)
+
+    def configure(self):
+        syslog.syslog(syslog.LOG_INFO, "Reading configuration")
+        config = read_config(self.config_file)
+
+        loglevel = str2loglevel(config.get('loglevel', 'INFO'))
+        if loglevel != self.loglevel:
+            self.loglevel = loglevel
+            syslog.setlogmask(syslog.LOG_MASK(loglevel))
+
+        self.prefetch = timedelta(seconds=config.get('prefetch_seconds', 30))
+        self.fetch_timeout = config.get('fetch_timeout', 60)
+        self.retry_base = config.get('retry_base', 10)
+        self.retry_max = config.get('retry_max', 1800)
+        user_agent = config['user_agent']
+        new_user_agent = user_agent != self.user_agent
+        self.user_agent = user_agent
+        cache_dir = config.get('cache_dir', './cache')
+        self.config = config
+        self.cache_dir = cache_dir
+        self.history_file = config.get('history_file', os.path.join(cache_dir, 'history'))
+        self.history_records = config.get('history_records', 65536)
+        self.record_dir = config.get('record_dir')
+        self.metrics_textfile = config.get('metrics_textfile')
+        metrics.default.profile_dir = config.get('profile_dir', os.path.join(cache_dir, 'profiles'))
+        if 'metrics_port' in config and self.metrics_server is None:
+            self.metrics_server = metrics.default.serve('localhost', config['metrics_port'])
+
+        places = {entry['name']: entry for entry in locations_config(config)}
+        outputs = []
+        for entry in displays_config(config):
+            place = places[entry['location']]
+            entry = {'placename': place['placename'], **entry}
+            out = output(entry['name'], entry,
+                         entry.get('hours', config.get('hours', render_svg.renderer.hours)),
+                         entry.get('prerender_hours', config.get('prerender_hours', 6)))
+            out.location = location_key(place['lat'], place['long'])
+            outputs.append(out)
+
+        locations = {}
+        for key in dict.fromkeys(out.location for out in outputs):
+            sharing = [out for out in outputs if out.location == key]
+            fields = tuple(dict.fromkeys(f for out in sharing for f in out.fields))
+            endpoint = fetch.choose_endpoint(config.get('endpoint', 'auto'), fields)
+            url = fetch.forecast_url(key[0], key[1], endpoint)
+            old = self.locations.get(key)
+            if old and old.url == url:
+                loc = old
+                loc.outputs = []
+            else:
+                loc = location(key, url, fetch.forecast_cache(os.path.join(cache_dir, '{},{}'.format(*key))))
+            if new_user_agent:
+                loc.wake.set()
+            loc.visible_hours = max(out.visible_hours for out in sharing)
+            hours = max(out.hours for out in sharing)
+            if loc.forecast is None or loc.fields != fields or loc.hours < hours:
+                loc.fields = fields
+                loc.hours = hours
+                loc.forecast = load_forecast(loc.cache, url, fields, self.now(), hours)
+                if loc.forecast:
+                    syslog.syslog(syslog.LOG_INFO, "Using cached forecast for {}".format(loc.describe()))
+            for out in sharing:
+                out.location = loc
+                loc.outputs.append(out)
+            locations[key] = loc
+
+        self.locations = locations
+        self.outputs = outputs
+        for loc in locations.values():
+            self.forecast_updated(loc)
+
+    def forecast_updated(self, loc):
+        if loc.forecast is None:
+            return
+        now = self.now()
+        for out in loc.outputs:
+            if self.prerenderer and out.spec and out.prerender_hours > 0:
+                self.prerenderer.submit(loc.key, out.spec, loc.forecast, now, out.prerender_hours)
+            out.render_queue.put_nowait('forecast')
+
+    def start_fetching(self):
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = [asyncio.create_task(self.clock())]
+        for loc in self.locations.values():
+            self.tasks.append(asyncio.create_task(self.fetcher(loc)))
+
+    async def start_output(self):
+        outputs = self.outputs
+        await asyncio.get_running_loop().run_in_executor(None, self.prepare, outputs)
+        if outputs is not self.outputs:
+            return
+        self.prepare_prerenderer(outputs)
+        for out in outputs:
+            if out.renderer is None:
+                continue
+            self.tasks.append(asyncio.create_task(self.render(out)))
+            self.tasks.append(asyncio.create_task(self.output(out)))
+        for loc in self.locations.values():
+            self.forecast_updated(loc)
+
+    async def apply(self):
+        try:
+            self.configure()
+        except Exception as e:
+            log_exception("Failed to read configuration", e)
+            return
+        self.start_fetching()
+        await self.start_output()
+
+    def reload(self):
+        if self.config_wake is not None:
+            self.config_wake.set()
+            return
+        asyncio.ensure_future(self.apply())
+
+    async def configure_until_valid(self):
+        self.config_wake = asyncio.Event()
+        try:
+            while True:
+                try:
+                    self.configure()
+                    return
+                except Exception as e:
+                    log_exception("Failed to read configuration", e)
+                try:
+                    await asyncio.wait_for(self.config_wake.wait(), self.config_retry)
+                except asyncio.TimeoutError:
+                    pass
+                self.config_wake.clear()
+        finally:
+            self.config_wake = None
+
+    def fetch_delay(self, loc, attempt):
+        now = self.now()
+        if attempt > 0:
+            return backoff(attempt - 1, self.retry_base, self.retry_max)
+        if loc.forecast is None:
+            return 0
+        due = loc.forecast.next_update() - self.prefetch
+        if loc.last_fetch:
+            due = max(due, loc.last_fetch + timedelta(minutes=1))
+        return (due - now).total_seconds()
+
+    async def fetch(self, loc):
+        loop = asyncio.get_running_loop()
+        syslog.syslog(syslog.LOG_INFO, "Get data for location {}".format(loc.describe()))
+        name = '{},{}'.format(*loc.key)
+        response = await asyncio.wait_for(
+            loop.run_in_executor(None, lambda: metrics.timed('fetch', fetch.fetch_forecast, self.pool(), loc.url, self.user_agent, loc.cache, location=name)),
+            self.fetch_timeout)
+        loc.last_fetch = now = self.now()
+        metrics.inc('fetch', result='modified' if response.modified else 'not_modified')
+        metrics.event('fetch', location=name, modified=response.modified)
+        changed = response.modified or (loc.forecast is not None and not loc.forecast.is_version(response.headers))
+        if changed and self.record_dir:
+            try:
+                await loop.run_in_executor(None, self.record_response, loc)
+            except Exception as e:
+                log_exception("Failed to record response", e)
+        if changed or loc.forecast is None or not loc.forecast.covers(now, loc.visible_hours):
+            loc.forecast = await loop.run_in_executor(None, lambda: metrics.timed('parse', load_forecast, loc.cache, loc.url, loc.fields, now, loc.hours, location=name))
+            self.forecast_updated(loc)
+            if changed and loc.forecast:
+                try:
+                    await loop.run_in_executor(None, self.record_history, loc)
+                except Exception as e:
+                    log_exception("Failed to record forecast history", e)
+        else:
+            loc.forecast.refresh(response.headers)
+        self.export_metrics()
+
+    async def fetcher(self, loc):
+        attempt = 0
+        while True:
+            delay = self.fetch_delay(loc, attempt)
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(loc.wake.wait(), delay)
+                    attempt = 0
+                except asyncio.TimeoutError:
+                    pass
+            loc.wake.clear()
+            if attempt > 0:
+                metrics.inc('fetch_retries')
+            try:
+                await self.fetch(loc)
+                attempt = 0
+            except Exception as e:
+                attempt += 1
+                metrics.inc('fetch', result='timeout' if isinstance(e, asyncio.TimeoutError) else 'error')
+                syslog.syslog(syslog.LOG_ERR, "Failed to get data for {}, err={}".format(loc.describe(), e))
+                self.export_metrics()
+
+    async def clock(self):
+        while True:
+            now = self.now()
+            next_hour = now.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+            await asyncio.sleep((next_hour - now).total_seconds())
+            for out in self.outputs:
+                out.render_queue.put_nowait('tick')
+
+    async def render(self, out):
+        loop = asyncio.get_running_loop()
+        while True:
+            await out.render_queue.get()
+            while not out.render_queue.empty():
+                out.render_queue.get_nowait()
+            forecast = out.location.forecast
+            if forecast is None:
+                syslog.syslog(syslog.LOG_INFO, "No forecast to render yet for {}".format(out.name))
+                continue
+            try:
+                now = self.now()
+                frame = self.prerenderer.frame(out.location.key, out.spec, now) if self.prerenderer else None
+                if frame is None:
+                    import prerender
+                    start = time.perf_counter()
+                    frame = await loop.run_in_executor(None, prerender.render_frame,
+                                                       out.renderer, forecast, now, out.spec.dithering['chart'])
+                    metrics.inc('frames', source='inline')
+                    metrics.event('render', display=out.name, seconds='{:.3f}'.format(time.perf_counter() - start))
+                else:
+                    metrics.inc('frames', source='prerendered')
+                    metrics.event('render', display=out.name, prerendered=True)
+                if out.display_queue.full():
+                    out.display_queue.get_nowait()
+                out.display_queue.put_nowait((frame, out.color_settings.background))
+            except Exception as e:
+                log_exception("Caught exception", e)
+
+    def push(self, out, frame, background):
+        with self.device_locks[out.name], metrics.span('show', display=out.name):
+            return out.device.push(frame, background)
+
+    async def output(self, out):
+        loop = asyncio.get_running_loop()
+        while True:
+            frame, background = await out.display_queue.get()
+            try:
+                if out.frames.changed(frame, background):
+                    elapsed = await loop.run_in_executor(None, self.push, out, frame, background)
+                    out.frames.pushed()
+                    metrics.inc('display_refresh', display=out.name)
+                    metrics.event('show', display=out.name, seconds='{:.3f}'.format(elapsed))
+                else:
+                    metrics.inc('display_skipped', display=out.name)
+                    metrics.event('skip', display=out.name, skipped=out.frames.skipped)
+            except Exception as e:
+                log_exception("Caught exception", e)
+            self.export_metrics()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGHUP, self.reload)
+        metrics.default.install_signal_handlers(loop)
+        await self.configure_until_valid()
+        self.start_fetching()
+        await self.start_output()
+        await asyncio.Event().wait()
+
+class Test_backoff(unittest.TestCase):
+    def test_backoff_grows_and_is_bounded(self):
+        for attempt in range(10):
+            delay = backoff(attempt, 10, 1800)
+            self.assertGreaterEqual(delay, min(1800, 10 * 2 ** attempt) * 0.5)
+            self.assertLessEqual(delay, min(1800, 10 * 2 ** attempt) * 1.5)
+
+class Test_config(unittest.TestCase):
+    def test_single_location_config(self):
+        config = {'lat': 59.9, 'long': 10.7, 'placename': 'Oslo'}
+        self.assertEqual(locations_config(config), [{'name': 'default', 'lat': 59.9, 'long': 10.7, 'placename': 'Oslo'}])
+        self.assertEqual(displays_config(config), [{'name': 'default', 'location': 'default'}])
+
+    def test_nearby_coordinates_share_a_location(self):
+        self.assertEqual(location_key(59.91001, 10.75), location_key(59.91, 10.750004))
+        self.assertNotEqual(location_key(59.91, 10.75), location_key(59.9101, 10.75))
+
+class Test_metrics(unittest.TestCase):
+    def test_forecast_age_is_since_it_was_issued(self):
+        now = datetime(2024, 6, 25, 3, 30, 0, 0, pytz.utc)
+        sched = scheduler(None)
+        sched.now = lambda: now
+        fetched = location(location_key(59.91, 10.75), 'url', None)
+        fetched.last_fetch = now - timedelta(minutes=5)
+        fetched.forecast = wx({'properties': {'timeseries': []}}, {'expires': 'Tue, 25 Jun 2024 05:22:48 GMT', 'last-modified': 'Tue, 25 Jun 2024 02:30:00 GMT'})
+        unknown = location(location_key(60, 11), 'url', None)
+        unknown.last_fetch = now - timedelta(minutes=5)
+        unknown.forecast = wx({'properties': {'timeseries': []}}, {'expires': 'Tue, 25 Jun 2024 05:22:48 GMT'})
+        sched.locations = {fetched.key: fetched, unknown.key: unknown, (0, 0): location((0, 0), 'url', None)}
+        self.assertEqual(sched.forecast_ages(), {(('location', '59.91,10.75'),): 3600, (('location', '60,11'),): 300})
+
+class Test_fetch(unittest.TestCase):
+    def test_not_modified_parses_a_newer_cached_forecast(self):
+        import fixtures
+        from replay import http_date, replay_response
+        class not_modified:
+            def request(self, *args, **kwargs):
+                return replay_response(304, {'expires': http_date(fixtures.START + timedelta(hours=1))})
+        with tempfile.TemporaryDirectory() as directory:
+            sched = scheduler(None)
+            sched.now = lambda: fixtures.START + timedelta(minutes=30)
+            sched.http = not_modified()
+            sched.fetch_timeout = 10
+            sched.history_records = 0
+            loc = location(location_key(59.91, 10.75), 'url', fetch.forecast_cache(directory))
+            loc.fields = render_svg.renderer.fields
+            loc.hours = loc.visible_hours = 12
+            earlier = fixtures.START - timedelta(hours=1)
+            loc.cache.store('url', [fixtures.forecast_bytes('calm', start=earlier)], {'expires': http_date(fixtures.START), 'last-modified': http_date(earlier)})
+            loc.forecast = load_forecast(loc.cache, 'url', loc.fields, sched.now(), loc.hours)
+            loc.cache.store('url', [fixtures.forecast_bytes('calm')], {'expires': http_date(fixtures.START), 'last-modified': http_date(fixtures.START)})
+            asyncio.run(sched.fetch(loc))
+            self.assertEqual(loc.forecast.issued, fixtures.START)
+            self.assertEqual(loc.forecast.next_update(), fixtures.START + timedelta(hours=1))
+            parsed = loc.forecast
+            asyncio.run(sched.fetch(loc))
+            self.assertIs(loc.forecast, parsed)
+
+    def test_history_is_recorded_beyond_the_display_horizon(self):
+        import fixtures
+        from history import forecast_history
+        from replay import http_date, replay_response
+        class modified:
+            def request(self, *args, **kwargs):
+                return replay_response(200, {'expires': http_date(fixtures.START + timedelta(hours=1)), 'last-modified': http_date(fixtures.START)},
+                                       fixtures.forecast_bytes('calm'))
+        with tempfile.TemporaryDirectory() as directory:
+            sched = scheduler(None)
+            sched.now = lambda: fixtures.START + timedelta(minutes=30)
+            sched.http = modified()
+            sched.fetch_timeout = 10
+            sched.history_records = 1000
+            sched.history_file = os.path.join(directory, 'history')
+            loc = location(location_key(59.91, 10.75), 'url', fetch.forecast_cache(directory))
+            loc.fields = render_svg.renderer.fields
+            loc.hours = loc.visible_hours = 12
+            asyncio.run(sched.fetch(loc))
+            sched.history.close()
+            history = forecast_history(sched.history_file, 1000)
+            self.assertEqual(len(history), fixtures.HOURLY)
+            valid = fixtures.START + timedelta(hours=fixtures.HOURLY - 1)
+            self.assertEqual(len(history.forecasts_for(59.91, 10.75, valid)), 1)
+            history.close()
+
+class Test_configure(unittest.TestCase):
+    def configure(self, directory, displays, **settings):
+        config_file = os.path.join(directory, 'config.json')
+        with open(config_file, 'w') as f:
+            json.dump({'user_agent': 'test', 'cache_dir': directory, 'lat': 59.91, 'long': 10.75, 'placename': 'Test',
+                       'displays': [{'location': 'default', 'type': 'null', **display} for display in displays], **settings}, f)
+        return config_file
+
+    def test_location_fields_are_the_union_of_its_displays(self):
+        with tempfile.TemporaryDirectory() as directory:
+            sched = scheduler(self.configure(directory, [{'name': 'a', 'renderer': 'svg'}, {'name': 'b'}]))
+            sched.configure()
+            loc = sched.locations[location_key(59.91, 10.75)]
+            self.assertEqual(set(loc.fields), set(render_svg.renderer.fields))
+            self.assertEqual([out.name for out in loc.outputs], ['a', 'b'])
+
+    def test_startup_retries_until_the_configuration_is_valid(self):
+        async def start(sched, directory):
+            task = asyncio.ensure_future(sched.configure_until_valid())
+            await asyncio.sleep(0.05)
+            self.assertFalse(task.done())
+            self.configure(directory, [{'name': 'a'}])
+            sched.reload()
+            await asyncio.wait_for(task, 5)
+        with tempfile.TemporaryDirectory() as directory:
+            sched = scheduler(os.path.join(directory, 'config.json'))
+            sched.config_retry = 0.01
+            asyncio.run(start(sched, directory))
+            self.assertEqual([out.name for out in sched.outputs], ['a'])
+            self.assertIsNone(sched.config_wake)
+
+    def test_reload_during_setup_keeps_one_prerenderer(self):
+        async def reload_twice(sched):
+            sched.configure()
+            first = asyncio.ensure_future(sched.start_output())
+            await asyncio.sleep(0)
+            sched.configure()
+            await asyncio.gather(first, sched.start_output())
+            pool = sched.prerenderer
+            for task in sched.tasks:
+                task.cancel()
+            await asyncio.gather(*sched.tasks, return_exceptions=True)
+            return pool
+        with tempfile.TemporaryDirectory() as directory:
+            sched = scheduler(self.configure(directory, [{'name': 'a'}, {'name': 'b'}], prerender_workers=2))
+            sched.now = lambda: datetime(2024, 6, 25, 3, 30, 0, 0, pytz.utc)
+            pool = asyncio.run(reload_twice(sched))
+            try:
+                self.assertIsNotNone(pool)
+                self.assertEqual(pool.workers, 2)
+                self.assertEqual(len(sched.tasks), 4)
+            finally:
+                pool.shutdown()
+
+class Test_startup(unittest.TestCase):
+    def test_render_stack_is_not_imported_at_startup(self):
+        code = 'import sys, wx; print(sorted(m for m in ("numpy", "PIL", "urllib3", "inky") if m in sys.modules))'
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(result.stdout.strip(), '[]')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+
+import unittest
+from datetime import datetime, timedelta
+import numpy
+import pytz
+
+import wx_data
+from wx_data import WeatherData, epoch2time
+
+HOUR = 3600
+BUCKETS = [1, 2, 3, 6, 12, 24]
+INSTANT = ('air_temperature', 'wind_speed', 'wind_speed_percentile_90')
+PERIOD = ('precipitation_amount', 'precipitation_amount_min', 'precipitation_amount_max')
+MEAN = ('air_temperature',)
+MAX = ('wind_speed', 'wind_speed_percentile_90')
+
+def bucket_size(hours, max_columns):
+    for step in BUCKETS:
+        if hours <= step*max_columns:
+            return step
+    return BUCKETS[-1]
+
+def uniform(forecast, start, hours):
+    timestamps = numpy.frombuffer(forecast.timestamps, dtype=numpy.float64)
+    first = numpy.searchsorted(timestamps, start.timestamp())
+    if first == len(timestamps):
+        return numpy.empty(0), {name: numpy.empty(0) for name in forecast.columns}, numpy.empty(0, dtype=numpy.uint16)
+    periods = numpy.frombuffer(forecast.periods, dtype=numpy.uint8)
+    last = min(timestamps[first] + (hours - 1)*HOUR, timestamps[-1] + (int(periods[-1]) - 1)*HOUR)
+    times = numpy.arange(timestamps[first], last + 1, HOUR)
+    rows = numpy.searchsorted(timestamps, times, side='right') - 1
+    columns = {}
+    for name, column in forecast.columns.items():
+        values = numpy.frombuffer(column, dtype=numpy.float64)
+        if name in INSTANT:
+            columns[name] = numpy.interp(times, timestamps, values)
+        elif name in PERIOD:
+            columns[name] = values[rows]/periods[rows]
+        else:
+            columns[name] = values[rows]
+    symbols = numpy.frombuffer(forecast.symbols, dtype=numpy.uint16)[rows]
+    return times, columns, symbols
+
+def aggregate(times, columns, symbols, step):
+    if step == 1:
+        return times, columns, symbols
+    buckets = len(times)//step
+    length = buckets*step
+    aggregated = {}
+    for name, values in columns.items():
+        values = values[:length].reshape(buckets, step)
+        if name in PERIOD:
+            aggregated[name] = values.sum(axis=1)
+        elif name in MEAN:
+            aggregated[name] = values.mean(axis=1)
+        elif name in MAX:
+            aggregated[name] = values.max(axis=1)
+    if 'wind_from_direction' in columns:
+        speed = columns.get('wind_speed_percentile_90', columns.get('wind_speed'))
+        directions = columns['wind_from_direction'][:length].reshape(buckets, step)
+        if speed is None:
+            aggregated['wind_from_direction'] = directions[:, step//2]
+        else:
+            strongest = speed[:length].reshape(buckets, step).argmax(axis=1)
+            aggregated['wind_from_direction'] = directions[numpy.arange(buckets), strongest]
+    return times[:length:step], aggregated, symbols[step//2:length:step]
+
+class series:
+    def __init__(self, key, forecast, times, columns, symbols, step):
+        self.key = key
+        self.forecast = forecast
+        self.times = times
+        self.columns = columns
+        self.codes = symbols
+        self.step = step
+
+    def __len__(self):
+        return len(self.times)
+
+    def __eq__(self, other):
+        return isinstance(other, series) and self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def time(self, index):
+        return epoch2time(self.times[index])
+
+    def timestamps(self):
+        return self.times
+
+    def column(self, name):
+        return self.columns[name]
+
+    def symbols(self):
+        codes = self.forecast.symbol_codes
+        return [codes[s] for s in self.codes]
+
+def window(forecast, now, hours, step):
+    predictions = forecast.window(now, hours)
+    times, columns, symbols = aggregate(*uniform(forecast, now, hours), step)
+    key = (forecast, predictions.sequence.start, hours, step)
+    return WeatherData(predictions.current, series(key, forecast, times, columns, symbols, step))
+
+def _forecast():
+    start = datetime(2024, 6, 25, 0, 0, 0, 0, pytz.utc)
+    timeseries = []
+    for h in list(range(12)) + [12, 18]:
+        entry = wx_data._entry((start + timedelta(hours=h)).strftime('%Y-%m-%dT%H:%M:%SZ'), h)
+        entry['data']['instant']['details'].update({'wind_speed_percentile_90': h % 5, 'wind_from_direction': 10*h})
+        period = entry['data'].pop('next_1_hours')
+        period['details'] = {'precipitation_amount': 1 if h < 12 else 6}
+        entry['data']['next_1_hours' if h < 12 else 'next_6_hours'] = period
+        timeseries.append(entry)
+    return wx_data.wx({'properties': {'timeseries': timeseries}}, {'expires': 'Tue, 25 Jun 2024 05:22:48 GMT'}), start
+
+class Test_series(unittest.TestCase):
+    def test_bucket_size(self):
+        self.assertEqual(bucket_size(12, 21), 1)
+        self.assertEqual(bucket_size(48, 21), 3)
+        self.assertEqual(bucket_size(9*24, 21), 12)
+        self.assertEqual(bucket_size(30*24, 2), 24)
+
+    def test_uniform_merges_six_hour_periods(self):
+        forecast, start = _forecast()
+        times, columns, symbols = uniform(forecast, start, 48)
+        self.assertEqual(len(times), 24)
+        self.assertEqual(list(numpy.diff(times)), [HOUR]*23)
+        self.assertEqual(list(columns['air_temperature'][10:14]), [10, 11, 12, 13])
+        self.assertEqual(list(columns['precipitation_amount'][10:20]), [1]*10)
+        self.assertEqual(columns['wind_from_direction'][20], 180)
+
+    def test_aggregate(self):
+        forecast, start = _forecast()
+        times, columns, symbols = aggregate(*uniform(forecast, start, 48), 6)
+        self.assertEqual(len(times), 4)
+        self.assertEqual(list(columns['precipitation_amount']), [6, 6, 6, 6])
+        self.assertEqual(list(columns['air_temperature']), [2.5, 8.5, 14.5, 18])
+        self.assertEqual(list(columns['wind_speed_percentile_90'][:2]), [4, 4])
+        self.assertEqual(list(columns['wind_from_direction']), [40, 90, 120, 180])
+        self.assertEqual(len(symbols), 4)
+
+    def test_window_is_a_cache_key(self):
+        forecast, start = _forecast()
+        first = window(forecast, start, 48, 6)
+        self.assertEqual(first.sequence, window(forecast, start, 48, 6).sequence)
+        self.assertNotEqual(first.sequence, window(forecast, start + timedelta(hours=1), 48, 6).sequence)
+        self.assertEqual(first.sequence.time(1), start + timedelta(hours=6))
+
+if __name__ == '__main__':
+    unittest.main()
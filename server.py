@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+
+import argparse
+import io
+import os
+import sys
+import syslog
+import tempfile
+import threading
+import unittest
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import pytz
+import urllib3
+
+import fetch
+import metrics
+import prerender
+import render_svg
+import wx_data
+from colors import colors
+from scheduler import load_forecast, location_key, read_config
+
+FORMATS = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+    'palette': 'application/octet-stream'
+}
+
+MAX_SIZE = 2000
+MAX_HOURS = 240
+RETRY_INTERVAL = timedelta(minutes=1)
+
+class frame_server:
+    def __init__(self, config, max_entries = 100, max_renderers = 16):
+        self.user_agent = config['user_agent']
+        self.cache_dir = config.get('cache_dir', './cache')
+        self.backend = config.get('renderer', 'raster')
+        self.dithering = {'chart': 'nearest', 'icons': 'diffusion', **config.get('dithering', {})}
+        self.precision = config.get('svg_precision', 1)
+        self.endpoint = fetch.choose_endpoint(config.get('endpoint', 'auto'), render_svg.renderer.fields)
+        self.http = urllib3.PoolManager(timeout=urllib3.Timeout(connect=10, read=30), retries=False)
+        self.max_entries = max_entries
+        self.max_renderers = max_renderers
+        self.locations = {}
+        self.renderers = OrderedDict()
+        self.frames = OrderedDict()
+        self.lock = threading.Lock()
+
+    def location(self, key):
+        with self.lock:
+            if key not in self.locations:
+                url = fetch.forecast_url(key[0], key[1], self.endpoint)
+                cache = fetch.forecast_cache(os.path.join(self.cache_dir, '{},{}'.format(*key)))
+                self.locations[key] = [threading.Lock(), url, cache, None, None]
+            return self.locations[key]
+
+    def forecast(self, key, now):
+        entry = self.location(key)
+        lock = entry[0]
+        if not lock.acquire(blocking=entry[3] is None):
+            return entry[3]
+        try:
+            _, url, cache, forecast, last_fetch = entry
+            expired = forecast is None or forecast.next_update() <= now
+            if expired and (last_fetch is None or now - last_fetch >= RETRY_INTERVAL):
+                entry[4] = now
+                try:
+                    syslog.syslog(syslog.LOG_INFO, "Get data for location lat={}, long={}".format(*key))
+                    response = metrics.timed('fetch', fetch.fetch_forecast, self.http, url, self.user_agent, cache)
+                except Exception as e:
+                    metrics.inc('fetch', result='error')
+                    syslog.syslog(syslog.LOG_ERR, "Failed to get data, err={}".format(e))
+                else:
+                    metrics.inc('fetch', result='modified' if response.modified else 'not_modified')
+                    if response.modified or forecast is None:
+                        forecast = load_forecast(cache, url, render_svg.renderer.fields, None, None)
+                    else:
+                        forecast.refresh(response.headers)
+                if forecast is None:
+                    forecast = load_forecast(cache, url, render_svg.renderer.fields, None, None)
+                entry[3] = forecast
+            return forecast
+        finally:
+            lock.release()
+
+    def renderer(self, backend, resolution, place, color_settings, hours):
+        key = (backend, resolution, place, color_settings, hours)
+        with self.lock:
+            if key in self.renderers:
+                self.renderers.move_to_end(key)
+                return self.renderers[key]
+        spec = prerender.RendererSpec(
+            backend=backend,
+            resolution=resolution,
+            place=place,
+            colors=dict(color_settings),
+            icon_dir=os.path.join(os.getcwd(), 'weather', 'svg'),
+            icon_store=os.path.join(self.cache_dir, 'icons'),
+            dithering=self.dithering,
+            precision=self.precision,
+            hours=hours)
+        renderer = (threading.Lock(), prerender.make_renderer(spec))
+        with self.lock:
+            renderer = self.renderers.setdefault(key, renderer)
+            if len(self.renderers) > self.max_renderers:
+                self.renderers.popitem(last=False)
+        return renderer
+
+    def render(self, forecast, now, fmt, resolution, place, color_settings, hours):
+        backend = 'svg' if fmt == 'svg' else self.backend
+        lock, renderer = self.renderer(backend, resolution, place, color_settings, hours)
+        with lock:
+            if fmt == 'svg':
+                return renderer.render_svg(forecast, now).encode()
+            frame = prerender.render_frame(renderer, forecast, now, self.dithering['chart'])
+        if fmt == 'palette':
+            return frame.tobytes()
+        png = io.BytesIO()
+        frame.save(png, 'PNG')
+        return png.getvalue()
+
+    def frame(self, lat, lon, width, height, fmt = 'png', place = '', color_settings = (), now = None, hours = render_svg.renderer.hours):
+        if fmt not in FORMATS:
+            raise ValueError("Unknown format {}".format(fmt))
+        if not (0 < width <= MAX_SIZE and 0 < height <= MAX_SIZE):
+            raise ValueError("Unsupported size {}x{}".format(width, height))
+        if not (2 <= hours <= MAX_HOURS):
+            raise ValueError("Unsupported horizon {}h".format(hours))
+        now = now if now else datetime.now(tz=pytz.UTC)
+        location = location_key(lat, lon)
+        forecast = self.forecast(location, now)
+        if forecast is None:
+            return None
+        hour = prerender.hour_of(now)
+        key = (location, forecast.next_update(), hour, (width, height), color_settings, place, fmt, hours)
+        with self.lock:
+            if key in self.frames:
+                self.frames.move_to_end(key)
+                metrics.inc('frame_cache', result='hit')
+                return self.frames[key]
+        metrics.inc('frame_cache', result='miss')
+        data = self.render(forecast, hour + timedelta(seconds=1), fmt, (width, height), place, color_settings, hours)
+        with self.lock:
+            self.frames[key] = data
+            if len(self.frames) > self.max_entries:
+                self.frames.popitem(last=False)
+        return data
+
+def color_settings(query):
+    defaults = vars(colors({}))
+    return tuple(sorted((name, query[name][0]) for name in defaults if name in query))
+
+class handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/metrics':
+            metrics.write_metrics(self)
+            return
+        if url.path != '/frame':
+            self.send_error(404)
+            return
+        query = parse_qs(url.query)
+        try:
+            fmt = query.get('format', ['png'])[0]
+            width = int(query['w'][0])
+            height = int(query['h'][0])
+            data = self.server.frames.frame(float(query['lat'][0]), float(query['lon'][0]), width, height, fmt,
+                                            query.get('name', [''])[0], color_settings(query),
+                                            hours=int(query.get('hours', [render_svg.renderer.hours])[0]))
+        except (KeyError, ValueError) as e:
+            self.send_error(400, str(e))
+            return
+        if data is None:
+            self.send_error(503, "No forecast available")
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', FORMATS[fmt])
+        self.send_header('Content-Length', str(len(data)))
+        if fmt == 'palette':
+            self.send_header('X-Frame-Size', '{}x{}'.format(width, height))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        syslog.syslog(syslog.LOG_DEBUG, format % args)
+
+def serve(config, host, port):
+    httpd = ThreadingHTTPServer((host, port), handler)
+    httpd.frames = frame_server(config, config.get('frame_cache_entries', 100))
+    syslog.syslog(syslog.LOG_INFO, "Serving frames on {}:{}".format(host, port))
+    httpd.serve_forever()
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", type=str, help="configuration file (defaults to ./config.json)")
+    parser.add_argument("--host", type=str, default='localhost', help="address to listen on (defaults to localhost)")
+    parser.add_argument("--port", type=int, default=8080, help="port to listen on (defaults to 8080)")
+    args, _ = parser.parse_known_args()
+
+    syslog.openlog()
+    syslog.setlogmask(syslog.LOG_MASK(syslog.LOG_INFO))
+    serve(read_config(args.config), args.host, args.port)
+    return 0
+
+class Test_frame_server(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.server = frame_server({'user_agent': 'test', 'cache_dir': self.dir.name,
+                                    'dithering': {'icons': 'nearest'}}, max_entries=2)
+        forecast = wx_data._chart_forecast()
+        self.server.location(location_key(59.9, 10.7))[3] = forecast
+        self.now = datetime(2024, 6, 25, 3, 30, 0, 0, pytz.utc)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_repeated_request_is_cached(self):
+        first = self.server.frame(59.9, 10.7, 60, 40, 'palette', now=self.now)
+        self.assertEqual(len(first), 60*40)
+        self.assertIs(self.server.frame(59.90001, 10.7, 60, 40, 'palette', now=self.now + timedelta(minutes=20)), first)
+        self.assertIsNot(self.server.frame(59.9, 10.7, 60, 40, 'palette', now=self.now + timedelta(hours=1)), first)
+
+    def test_least_recently_used_frame_is_evicted(self):
+        for width in [60, 61, 62]:
+            self.server.frame(59.9, 10.7, width, 40, 'png', now=self.now)
+        self.assertEqual([key[3] for key in self.server.frames], [(61, 40), (62, 40)])
+
+    def test_horizon_is_part_of_the_key(self):
+        day = self.server.frame(59.9, 10.7, 600, 448, 'svg', now=self.now, hours=24)
+        self.assertIsNot(self.server.frame(59.9, 10.7, 600, 448, 'svg', now=self.now), day)
+        self.assertIn(b'>06</text>', day)
+        self.assertNotIn(b'>05</text>', day)
+
+    def test_expired_forecast_is_fetched_at_most_once_a_minute(self):
+        class failing_http:
+            requests = 0
+            def request(self, *args, **kwargs):
+                self.requests += 1
+                raise urllib3.exceptions.ProtocolError("unreachable")
+        self.server.http = failing_http()
+        later = datetime(2024, 6, 25, 6, 10, 0, 0, pytz.utc)
+        stale = self.server.frame(59.9, 10.7, 60, 40, 'palette', now=later)
+        self.assertEqual(len(stale), 60*40)
+        self.assertIs(self.server.frame(59.9, 10.7, 60, 40, 'palette', now=later + timedelta(seconds=50)), stale)
+        self.assertEqual(self.server.http.requests, 1)
+        self.server.frame(59.9, 10.7, 60, 40, 'palette', now=later + timedelta(minutes=1))
+        self.assertEqual(self.server.http.requests, 2)
+
+    def test_invalid_request(self):
+        with self.assertRaises(ValueError):
+            self.server.frame(59.9, 10.7, 60, 40, 'gif', now=self.now)
+        with self.assertRaises(ValueError):
+            self.server.frame(59.9, 10.7, 0, 40, now=self.now)
+        with self.assertRaises(ValueError):
+            self.server.frame(59.9, 10.7, 60, 40, now=self.now, hours=1000)
+
+    def test_color_settings(self):
+        self.assertEqual(color_settings({'background': ['yellow'], 'lat': ['1']}), (('background', 'yellow'),))
+
+if __name__ == '__main__':
+    sys.exit(run())
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+
+import os
+import tempfile
+import time
+import unittest
+from collections import deque
+import numpy
+from PIL import Image
+
+import quantize
+
+DEFAULT_RESOLUTION = (600, 448)
+
+def str2display_color(name: str, display):
+    if name == 'black':
+        return display.BLACK
+    if name == 'white':
+        return display.WHITE
+    if name == 'blue':
+        return display.BLUE
+    if name == 'green':
+        return display.GREEN
+    if name == 'orange':
+        return display.ORANGE
+    if name == 'red':
+        return display.RED
+    if name == 'yellow':
+        return display.YELLOW
+
+class sink:
+    def __init__(self, resolution, history = 100):
+        self.resolution = resolution
+        self.timings = deque(maxlen=history)
+
+    def push(self, frame, border):
+        start = time.perf_counter()
+        self.write(frame, border)
+        elapsed = time.perf_counter() - start
+        self.timings.append(elapsed)
+        return elapsed
+
+    def write(self, frame, border):
+        pass
+
+class null_sink(sink):
+    def __init__(self, entry):
+        super().__init__(tuple(entry.get('resolution', DEFAULT_RESOLUTION)))
+
+class file_sink(sink):
+    def __init__(self, entry):
+        super().__init__(tuple(entry.get('resolution', DEFAULT_RESOLUTION)))
+        self.path = entry['path']
+        self.format = entry.get('format', 'png')
+        if self.format not in ('png', 'raw'):
+            raise ValueError("Unknown file format {}".format(self.format))
+
+    def write(self, frame, border):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp = self.path + '.tmp'
+        if self.format == 'png':
+            frame.save(tmp, 'PNG')
+        else:
+            with open(tmp, 'wb') as f:
+                f.write(frame.tobytes())
+        os.replace(tmp, self.path)
+
+class inky_sink(sink):
+    def __init__(self, entry):
+        from inky.auto import auto
+        self.display = auto()
+        super().__init__(self.display.resolution)
+
+    def write(self, frame, border):
+        self.display.set_image(frame)
+        self.display.set_border(str2display_color(border, self.display))
+        self.display.show()
+
+SINKS = {
+    'inky': inky_sink,
+    'file': file_sink,
+    'null': null_sink
+}
+
+def open_sink(entry):
+    kind = entry.get('type', 'inky')
+    if kind not in SINKS:
+        raise ValueError("Unknown display type {}".format(kind))
+    return SINKS[kind](entry)
+
+class Test_sinks(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.frame = quantize.to_image(numpy.array([[0, 4, 6]], dtype=numpy.uint8))
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_null_sink_records_timings(self):
+        display = open_sink({'type': 'null', 'resolution': [3, 1]})
+        self.assertEqual(display.resolution, (3, 1))
+        display.push(self.frame, 'white')
+        self.assertEqual(len(display.timings), 1)
+
+    def test_png_file_sink(self):
+        path = os.path.join(self.dir.name, 'out', 'frame.png')
+        open_sink({'type': 'file', 'path': path}).push(self.frame, 'white')
+        with Image.open(path) as image:
+            self.assertEqual(image.convert('RGB').getpixel((1, 0)), (255, 0, 0))
+
+    def test_raw_file_sink(self):
+        path = os.path.join(self.dir.name, 'frame.raw')
+        open_sink({'type': 'file', 'path': path, 'format': 'raw'}).push(self.frame, 'white')
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), bytes([0, 4, 6]))
+
+    def test_unknown_type(self):
+        with self.assertRaises(ValueError):
+            open_sink({'type': 'lcd'})
+
+if __name__ == '__main__':
+    unittest.main()
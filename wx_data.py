@@ -1,9 +1,15 @@
 #!/usr/bin/env python
 
-from datetime import datetime
+from datetime import datetime, timedelta
+from array import array
+from bisect import bisect_left
+import codecs
+import json
+import math
+import re
 import unittest
 import pytz
-from collections import namedtuple
+from collections import namedtuple, ChainMap
 
 def parse_header_timestamp(timestamp):
     return datetime.strptime(timestamp, "%a, %d %b %Y %H:%M:%S %Z").replace(tzinfo=pytz.UTC)
@@ -13,56 +19,254 @@ def parse_timestamp(timestamp):
 
 Prediction = namedtuple('Prediction', ['timestamp', 'data'])
 
+FIELD_FALLBACKS = {
+    'precipitation_amount_min': 'precipitation_amount',
+    'precipitation_amount_max': 'precipitation_amount',
+    'wind_speed_percentile_90': 'wind_speed'
+}
 
-class PredictionSet:
-    def __init__(self, data, max = 12):
-        self.data = data
-        self.max = max
+def project(values, fields):
+    if fields is None:
+        return dict(values)
+    projected = {}
+    for field in fields:
+        if field in values:
+            projected[field] = values[field]
+        elif FIELD_FALLBACKS.get(field) in values:
+            projected[field] = values[FIELD_FALLBACKS[field]]
+    return projected
+
+PERIODS = ((1, 'next_1_hours'), (6, 'next_6_hours'))
+
+TIMESERIES = re.compile(r'"timeseries"\s*:\s*\[')
+SEPARATORS = re.compile(r'[\s,]*')
+
+def iter_timeseries(chunks):
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    pos = -1
+    for chunk in chunks:
+        buffer += utf8.decode(chunk)
+        if pos < 0:
+            match = TIMESERIES.search(buffer)
+            if match is None:
+                buffer = buffer[-32:]
+                continue
+            pos = match.end()
+        while True:
+            pos = SEPARATORS.match(buffer, pos).end()
+            if buffer.startswith(']', pos):
+                return
+            try:
+                entry, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                break
+            yield entry
+        buffer = buffer[pos:]
+        pos = 0
+    raise ValueError("Truncated forecast timeseries")
+
+def epoch2time(seconds):
+    return datetime.fromtimestamp(seconds, pytz.UTC)
+
+class PredictionSet(namedtuple('PredictionSet', ['forecast', 'start', 'stop'])):
+    __slots__ = ()
+
+    def __len__(self):
+        return self.stop - self.start
 
     def __iter__(self):
-        self.current = 0
-        return self
+        for index in range(self.start, self.stop):
+            yield self.forecast.row(index)
+
+    def timestamps(self):
+        return memoryview(self.forecast.timestamps).toreadonly()[self.start:self.stop]
+
+    def time(self, index):
+        return epoch2time(self.forecast.timestamps[self.start + index])
+
+    def column(self, name):
+        return memoryview(self.forecast.columns[name]).toreadonly()[self.start:self.stop]
 
-    def __next__(self):
-        if self.current >= self.max or self.current >= len(self.data):
-            raise StopIteration
-        prediction = self.data[self.current]
-        self.current += 1
-        return prediction
+    def symbols(self):
+        codes = self.forecast.symbol_codes
+        return [codes[s] for s in self.forecast.symbols[self.start:self.stop]]
 
 WeatherData = namedtuple('WeatherData', ['current', 'sequence'])
 class wx:
-    def __init__(self, json_data, headers):
-        self.prediction_data = []
-        for obs in json_data['properties']['timeseries']:
+    def __init__(self, json_data, headers, fields = None):
+        self._load(json_data['properties']['timeseries'], headers, fields)
+
+    @classmethod
+    def from_stream(cls, chunks, headers, fields = None, start = None, hours = None):
+        forecast = cls.__new__(cls)
+        forecast._load(iter_timeseries(chunks), headers, fields, start, hours)
+        return forecast
+
+    def _load(self, timeseries, headers, fields, start = None, hours = None):
+        first = start - timedelta(hours=1) if start else None
+        last = start + timedelta(hours=hours) if start and hours else None
+        self.timestamps = array('d')
+        self.periods = array('B')
+        self.columns = {}
+        self.symbols = array('H')
+        self.symbol_codes = [None]
+        self._symbol_index = {None: 0}
+        self.truncated = False
+        for obs in timeseries:
+            timestamp = parse_timestamp(obs['time'])
+            if last and timestamp > last:
+                self.truncated = True
+                break
+            if first and timestamp < first:
+                continue
             data = obs['data']
-            if not 'next_1_hours' in data:
+            for period, name in PERIODS:
+                if name in data:
+                    break
+            else:
                 continue
-            instant = data['instant']['details']
-            next_h = data['next_1_hours']
-            self.prediction_data.append(Prediction(
-                parse_timestamp(obs['time']),
-                {
-                **instant,
-                **next_h['details'],
-                **next_h['summary']
-                })
-            )
-        self.prediction_data.sort(key = lambda obs: obs[0])
+            next_h = data[name]
+            self._append(timestamp, period, project(ChainMap(
+                data['instant']['details'],
+                next_h.get('details', {}),
+                next_h['summary']
+                ), fields))
+        self._sort()
         expiry_time = headers['expires']
         self.expiry = parse_header_timestamp(expiry_time)
-        self.current = None
+        self.issued = parse_header_timestamp(headers['last-modified']) if 'last-modified' in headers else None
+        self.etag = headers.get('etag')
+
+    def _append(self, timestamp, period, values):
+        rows = len(self.timestamps)
+        self.timestamps.append(timestamp.timestamp())
+        self.periods.append(period)
+        self.symbols.append(self.intern_symbol(values.get('symbol_code')))
+        for field, value in values.items():
+            if field == 'symbol_code':
+                continue
+            column = self.columns.get(field)
+            if column is None:
+                column = self.columns[field] = array('d', [math.nan]) * rows
+            column.append(value)
+        for column in self.columns.values():
+            if len(column) == rows:
+                column.append(math.nan)
+
+    def intern_symbol(self, code):
+        index = self._symbol_index.get(code)
+        if index is None:
+            index = len(self.symbol_codes)
+            self._symbol_index[code] = index
+            self.symbol_codes.append(code)
+        return index
+
+    def _sort(self):
+        order = sorted(range(len(self.timestamps)), key = self.timestamps.__getitem__)
+        if order == list(range(len(order))):
+            return
+        self.timestamps = array('d', [self.timestamps[i] for i in order])
+        self.periods = array('B', [self.periods[i] for i in order])
+        self.symbols = array('H', [self.symbols[i] for i in order])
+        for name, column in self.columns.items():
+            self.columns[name] = array('d', [column[i] for i in order])
+
+    def row(self, index):
+        data = {name: column[index] for name, column in self.columns.items()}
+        if self.symbols[index]:
+            data['symbol_code'] = self.symbol_codes[self.symbols[index]]
+        return Prediction(epoch2time(self.timestamps[index]), data)
 
     def next_update(self):
         return self.expiry
 
+    def is_version(self, headers):
+        issued = parse_header_timestamp(headers['last-modified']) if 'last-modified' in headers else None
+        return issued == self.issued and headers.get('etag') == self.etag
+
+    def refresh(self, headers):
+        self.expiry = parse_header_timestamp(headers['expires'])
+
+    def covers(self, now, hours):
+        if not self.truncated:
+            return True
+        return len(self.timestamps) > 0 and epoch2time(self.timestamps[-1]) >= now + timedelta(hours=hours - 1)
+
     def has_expired(self, now):
         return self.expiry > now
 
+    def hourly(self):
+        return bisect_left(self.periods, 2) if self.periods and self.periods[-1] > 1 else len(self.periods)
+
+    def window(self, start, hours):
+        first = bisect_left(self.timestamps, start.timestamp())
+        current = self.row(first - 1) if first > 0 else None
+        return WeatherData(current, PredictionSet(self, first, max(first, min(first + hours, self.hourly()))))
+
     def predictions(self, now, max = 12):
-        while len(self.prediction_data) > 0 and self.prediction_data[0].timestamp < now:
-            self.current = self.prediction_data.pop(0)
-        return WeatherData(self.current, PredictionSet(self.prediction_data))
+        return self.window(now, max)
+
+class Test_project(unittest.TestCase):
+    def test_drops_unused_fields(self):
+        self.assertEqual(project({'air_temperature': 1, 'relative_humidity': 50}, ['air_temperature']),
+                         {'air_temperature': 1})
+
+    def test_compact_fallbacks(self):
+        self.assertEqual(project({'precipitation_amount': 2, 'wind_speed': 3},
+                                 ['precipitation_amount_max', 'wind_speed_percentile_90']),
+                         {'precipitation_amount_max': 2, 'wind_speed_percentile_90': 3})
+
+def _entry(time, temp):
+    return {'time': time,
+            'data': {'instant': {'details': {'air_temperature': temp}},
+                     'next_1_hours': {'summary': {'symbol_code': 'fog'}}}}
+
+def _chart_timeseries(hours, temp = lambda h: 10 + h % 5, wind = lambda h: h, rain = lambda h: h % 3, rain_max = lambda h: h % 4, symbol = 'fog'):
+    start = datetime(2024, 6, 25, 0, 0, 0, 0, pytz.utc)
+    timeseries = []
+    for h in range(hours):
+        entry = _entry((start + timedelta(hours=h)).strftime('%Y-%m-%dT%H:%M:%SZ'), temp(h))
+        entry['data']['next_1_hours']['summary']['symbol_code'] = symbol
+        entry['data']['instant']['details'].update({'wind_speed_percentile_90': wind(h), 'wind_from_direction': 10*h})
+        entry['data']['next_1_hours']['details'] = {'precipitation_amount': rain(h), 'precipitation_amount_min': 0, 'precipitation_amount_max': rain_max(h)}
+        timeseries.append(entry)
+    return timeseries
+
+def _chart_forecast(hours = 24, **values):
+    return wx({'properties': {'timeseries': _chart_timeseries(hours, **values)}}, {'expires': 'Tue, 25 Jun 2024 05:22:48 GMT'})
+
+class Test_stream(unittest.TestCase):
+    document = json.dumps({
+        'type': 'Feature',
+        'properties': {
+            'meta': {'units': {'air_temperature': 'celsius'}},
+            'timeseries': [_entry('2024-06-25T0{}:00:00Z'.format(h), h) for h in range(10)]
+        }
+    }).encode()
+
+    def chunks(self, size):
+        return [self.document[i:i+size] for i in range(0, len(self.document), size)]
+
+    def test_entries_split_across_chunks(self):
+        for size in [1, 7, 100, len(self.document)]:
+            temps = [entry['data']['instant']['details']['air_temperature'] for entry in iter_timeseries(self.chunks(size))]
+            self.assertEqual(temps, list(range(10)))
+
+    def test_truncated_document(self):
+        with self.assertRaises(ValueError):
+            list(iter_timeseries([self.document[:-40]]))
+
+    def test_stops_at_horizon(self):
+        chunks = iter(self.chunks(50))
+        forecast = wx.from_stream(chunks, {'expires': 'Tue, 25 Jun 2024 05:22:48 GMT'},
+                                  start=datetime(2024, 6, 25, 3, 30, 0, 0, pytz.utc), hours=3)
+        self.assertEqual(list(forecast.columns['air_temperature']), [3, 4, 5, 6])
+        self.assertTrue(forecast.truncated)
+        self.assertGreater(len(list(chunks)), 0)
+        self.assertTrue(forecast.covers(datetime(2024, 6, 25, 3, 30, 0, 0, pytz.utc), 3))
+        self.assertFalse(forecast.covers(datetime(2024, 6, 25, 4, 30, 0, 0, pytz.utc), 3))
 
 class Test_wx(unittest.TestCase):
     def test_expiry(self):
@@ -128,10 +332,59 @@ class Test_wx(unittest.TestCase):
         idx = 0
         weather = forecast.predictions(datetime(2024, 6, 25, 4, 30, 00, 0, pytz.utc))
         for predictions in weather.sequence:
-            self.assertEqual(expected[idx][0], predictions[1])
-            self.assertEqual(expected[idx][1], predictions[2])
+            self.assertEqual(expected[idx][0]['air_temperature'], predictions.data['air_temperature'])
+            self.assertEqual(expected[idx][1], predictions.data['symbol_code'])
             idx += 1
         self.assertEqual(idx, 2)
+        self.assertEqual(weather.current.data['air_temperature'], 21)
+        self.assertEqual(list(weather.sequence.column('air_temperature')), [19, 17])
+        self.assertEqual(weather.sequence.symbols(), ['clearsky_day', 'fog'])
+
+    def test_window_is_not_destructive(self):
+        data = {'properties': {'timeseries': [_entry('2024-06-25T0{}:00:00Z'.format(h), h) for h in range(10)]}}
+        forecast = wx(data, {'expires': 'Tue, 25 Jun 2024 05:22:48 GMT'})
+        late = forecast.window(datetime(2024, 6, 25, 6, 30, 0, 0, pytz.utc), 12)
+        early = forecast.window(datetime(2024, 6, 25, 2, 0, 0, 0, pytz.utc), 3)
+        self.assertEqual(late.current.data['air_temperature'], 6)
+        self.assertEqual(list(late.sequence.column('air_temperature')), [7, 8, 9])
+        self.assertEqual(early.current.data['air_temperature'], 1)
+        self.assertEqual(list(early.sequence.column('air_temperature')), [2, 3, 4])
+        before = forecast.window(datetime(2024, 6, 24, 0, 0, 0, 0, pytz.utc), 1)
+        self.assertIsNone(before.current)
+        self.assertEqual(list(before.sequence.column('air_temperature')), [0])
+
+    def test_views_iterate_independently(self):
+        data = {'properties': {'timeseries': [_entry('2024-06-25T0{}:00:00Z'.format(h), h) for h in range(3)]}}
+        sequence = wx(data, {'expires': 'Tue, 25 Jun 2024 05:22:48 GMT'}).window(datetime(2024, 6, 25, 0, 0, 0, 0, pytz.utc), 3).sequence
+        pairs = [(a.data['air_temperature'], b.data['air_temperature']) for a in sequence for b in sequence]
+        self.assertEqual(len(pairs), 9)
+        with self.assertRaises(TypeError):
+            sequence.column('air_temperature')[0] = 5
+        with self.assertRaises(AttributeError):
+            sequence.start = 1
+
+    def test_unsorted_and_sparse_columns(self):
+        data = {'properties': {'timeseries': [_entry('2024-06-25T05:00:00Z', 19), _entry('2024-06-25T04:00:00Z', 21)]}}
+        data['properties']['timeseries'][0]['data']['instant']['details']['wind_speed'] = 3
+        forecast = wx(data, {'expires': 'Tue, 25 Jun 2024 05:22:48 GMT'})
+        self.assertEqual(list(forecast.columns['air_temperature']), [21, 19])
+        self.assertTrue(math.isnan(forecast.columns['wind_speed'][0]))
+        self.assertEqual(forecast.columns['wind_speed'][1], 3)
+
+    def test_six_hour_periods(self):
+        timeseries = [_entry('2024-06-25T0{}:00:00Z'.format(h), h) for h in range(3)]
+        for h in [3, 9]:
+            entry = _entry('2024-06-25T{:02}:00:00Z'.format(h), h)
+            entry['data']['next_6_hours'] = entry['data'].pop('next_1_hours')
+            timeseries.append(entry)
+        timeseries.append({'time': '2024-06-25T15:00:00Z', 'data': {'instant': {'details': {'air_temperature': 15}}}})
+        forecast = wx({'properties': {'timeseries': timeseries}}, {'expires': 'Tue, 25 Jun 2024 05:22:48 GMT'})
+        self.assertEqual(list(forecast.periods), [1, 1, 1, 6, 6])
+        self.assertEqual(list(forecast.predictions(datetime(2024, 6, 25, 0, 0, 0, 0, pytz.utc)).sequence.column('air_temperature')), [0, 1, 2])
+        late = forecast.window(datetime(2024, 6, 25, 5, 0, 0, 0, pytz.utc), 12)
+        self.assertEqual(len(late.sequence), 0)
+        self.assertEqual(late.current.data['air_temperature'], 3)
+        self.assertEqual(len(forecast.predictions(datetime(2024, 6, 25, 12, 0, 0, 0, pytz.utc)).sequence), 0)
 
 if __name__ == '__main__':
     unittest.main()